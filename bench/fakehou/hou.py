@@ -0,0 +1,936 @@
+"""
+Module:         hou stand-in for offline benchmarks
+Description:    Implements the parts of the Houdini Object Model that ruler.py 
+                calls (Geometry, Vector3, Matrix4, hmath, SOP verbs, drawables, 
+                viewer events, hotkeys, ui) on top of numpy, so the state can 
+                be driven and timed without a Houdini license. Geometry ops 
+                are plain Python and far slower than the real thing; compare 
+                timings against each other, not against Houdini.
+"""
+import importlib
+import math
+import os
+import sys
+import tempfile
+
+
+class _LazyNumpy(object):
+    """ The real hou does not import numpy, so neither does the stand-in 
+        until it is first used. Keeps import timings of ruler honest.
+    """
+    def __getattr__(self, attr):
+        module = importlib.import_module("numpy")
+        globals()["np"] = module
+        return getattr(module, attr)
+
+
+np = _LazyNumpy()
+
+
+class Error(Exception):
+    pass
+
+
+class _Vec(object):
+    N = 3
+
+    def __init__(self, *args):
+        if len(args) == 0:
+            v = [0.0] * self.N
+        elif len(args) == 1:
+            v = list(args[0])
+        else:
+            v = list(args)
+        self._v = [float(x) for x in v]
+
+    def __getitem__(self, i):
+        return self._v[i]
+
+    def __setitem__(self, i, x):
+        self._v[i] = float(x)
+
+    def __len__(self):
+        return self.N
+
+    def __iter__(self):
+        return iter(self._v)
+
+    def __add__(self, o):
+        return type(self)([a + b for a, b in zip(self._v, o)])
+
+    def __sub__(self, o):
+        return type(self)([a - b for a, b in zip(self._v, o)])
+
+    def __neg__(self):
+        return type(self)([-a for a in self._v])
+
+    def __mul__(self, o):
+        if isinstance(o, Matrix4):
+            r = np.dot(np.array(self._v + [1.0]), o._m)
+            return Vector3((r[:3] / r[3]).tolist())
+        return type(self)([a * o for a in self._v])
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, o):
+        return type(self)([a / o for a in self._v])
+    __div__ = __truediv__
+
+    def __eq__(self, o):
+        try:
+            return list(o) == self._v
+        except TypeError:
+            return False
+
+    def __ne__(self, o):
+        return not self == o
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, tuple(self._v))
+
+    def length(self):
+        return math.sqrt(sum(a * a for a in self._v))
+
+    def lengthSquared(self):
+        return sum(a * a for a in self._v)
+
+    def normalized(self):
+        l = self.length()
+        return type(self)([a / l for a in self._v]) if l else type(self)(self._v)
+
+    def dot(self, o):
+        return sum(a * b for a, b in zip(self._v, o))
+
+    def cross(self, o):
+        a, b = self._v, list(o)
+        return Vector3(a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+    def angleTo(self, o):
+        a, b = self.normalized(), Vector3(o).normalized()
+        d = max(-1.0, min(1.0, a.dot(b)))
+        return math.degrees(math.acos(d))
+
+    def distanceTo(self, o):
+        return (self - type(self)(o)).length()
+
+
+class Vector2(_Vec):
+    N = 2
+
+
+class Vector3(_Vec):
+    N = 3
+
+
+class Vector4(_Vec):
+    N = 4
+
+
+class Matrix4(object):
+    def __init__(self, values=1.0):
+        if isinstance(values, (int, float)):
+            self._m = np.identity(4) * values
+        else:
+            self._m = np.array(values, dtype=np.float64).reshape(4, 4)
+
+    def __mul__(self, o):
+        return Matrix4(np.dot(self._m, o._m))
+
+    def inverted(self):
+        return Matrix4(np.linalg.inv(self._m))
+
+    def at(self, r, c):
+        return float(self._m[r, c])
+
+    def asTuple(self):
+        return tuple(self._m.ravel().tolist())
+
+    def asTupleOfTuples(self):
+        return tuple(tuple(r) for r in self._m.tolist())
+
+    def __eq__(self, o):
+        return isinstance(o, Matrix4) and np.array_equal(self._m, o._m)
+
+    def __ne__(self, o):
+        return not self == o
+
+
+class hmath(object):
+    @staticmethod
+    def buildTranslate(*args):
+        v = args[0] if len(args) == 1 else args
+        m = np.identity(4)
+        m[3, :3] = list(v)
+        return Matrix4(m)
+
+    @staticmethod
+    def buildScale(*args):
+        v = args[0] if len(args) == 1 else args
+        if isinstance(v, (int, float)):
+            v = (v, v, v)
+        m = np.identity(4)
+        m[0, 0], m[1, 1], m[2, 2] = v
+        return Matrix4(m)
+
+    @staticmethod
+    def buildRotateAboutAxis(axis, degrees):
+        a = np.array(list(axis), dtype=np.float64)
+        a /= np.linalg.norm(a)
+        t = math.radians(degrees)
+        c, s = math.cos(t), math.sin(t)
+        x, y, z = a
+        r = np.array([
+            [c + x * x * (1 - c), x * y * (1 - c) - z * s, x * z * (1 - c) + y * s],
+            [y * x * (1 - c) + z * s, c + y * y * (1 - c), y * z * (1 - c) - x * s],
+            [z * x * (1 - c) - y * s, z * y * (1 - c) + x * s, c + z * z * (1 - c)]])
+        m = np.identity(4)
+        m[:3, :3] = r.T  # row-vector convention
+        return Matrix4(m)
+
+    @staticmethod
+    def buildRotateZToAxis(axis):
+        a = Vector3(axis).normalized()
+        z = Vector3(0, 0, 1)
+        c = z.cross(a)
+        if c.length() < 1e-9:
+            if a[2] > 0:
+                return Matrix4(1.0)
+            return hmath.buildRotateAboutAxis((1, 0, 0), 180)
+        return hmath.buildRotateAboutAxis(c, z.angleTo(a))
+
+    @staticmethod
+    def intersectPlane(plane_point, plane_normal, origin, direction):
+        n = Vector3(plane_normal)
+        d = Vector3(direction)
+        denom = n.dot(d)
+        if abs(denom) < 1e-12:
+            raise Error("parallel")
+        t = n.dot(Vector3(plane_point) - Vector3(origin)) / denom
+        return Vector3(origin) + d * t
+
+
+class attribType(object):
+    Point, Prim, Vertex, Global = range(4)
+
+
+class Point(object):
+    def __init__(self, geo, num):
+        self.geo, self._num = geo, num
+
+    def number(self):
+        return self._num
+
+    def position(self):
+        return Vector3(self.geo._P[self._num])
+
+    def setPosition(self, pos):
+        self.geo._P[self._num] = list(pos)
+
+    def setAttribValue(self, name, value):
+        self.geo._pattr[name][self._num] = value
+
+
+class Attrib(object):
+    def __init__(self, geo, name):
+        self.geo, self._name = geo, name
+
+    def name(self):
+        return self._name
+
+    def dataId(self):
+        """ Derived from the values rather than bumped on writes, which gives 
+            the same equal-while-untouched behaviour for a single attribute.
+        """
+        if self._name == "P":
+            return hash(self.geo._P.tobytes())
+        return hash(tuple(self.geo._pattr[self._name]))
+
+
+class Prim(object):
+    def __init__(self, geo, num):
+        self.geo, self._num = geo, num
+
+    def number(self):
+        return self._num
+
+    def points(self):
+        return tuple(Point(self.geo, i) for i in self.geo._prims[self._num])
+
+    def addVertex(self, point):
+        self.geo._prims[self._num].append(point.number())
+
+
+Polygon = Prim
+Face = Prim
+
+
+class PointGroup(object):
+    def __init__(self, geo, name):
+        self.geo, self._name = geo, name
+
+    def name(self):
+        return self._name
+
+    def points(self):
+        return tuple(Point(self.geo, i) for i in self.geo._groups[self._name])
+
+
+class Geometry(object):
+    def __init__(self):
+        self._P = np.zeros((0, 3))
+        self._groups = {} #point group name -> point numbers
+        self._pattr = {}
+        self._pdefault = {}
+        self._prims = []
+        self._primattr = {}
+        self._frozen = False
+        self._cook = 0
+
+    def _check(self):
+        if self._frozen:
+            raise Error("read only")
+
+    def freeze(self, read_only=False, clone_data_ids=False):
+        g = Geometry()
+        g._P = self._P.copy()
+        g._pattr = dict((k, list(v)) for k, v in self._pattr.items())
+        g._pdefault = dict(self._pdefault)
+        g._prims = [list(p) for p in self._prims]
+        g._frozen = read_only
+        return g
+
+    def addAttrib(self, atype, name, default):
+        self._check()
+        if atype == attribType.Point:
+            self._pdefault[name] = default
+            self._pattr[name] = [default] * len(self._P)
+        else:
+            self._primattr[name] = [default] * len(self._prims)
+
+    def findPointAttrib(self, name):
+        if name == "P" or name in self._pattr:
+            return Attrib(self, name)
+        return None
+
+    def findPointGroup(self, name):
+        return PointGroup(self, name) if name in self._groups else None
+
+    def topologyDataId(self):
+        return hash((len(self._P), tuple(tuple(p) for p in self._prims)))
+
+    def primitiveListDataId(self):
+        return len(self._prims)
+
+    def createPoint(self):
+        self._check()
+        self._P = np.vstack([self._P, np.zeros((1, 3))])
+        for k in self._pattr:
+            self._pattr[k].append(self._pdefault[k])
+        return Point(self, len(self._P) - 1)
+
+    def createPoints(self, positions):
+        self._check()
+        pos = np.array([list(p) for p in positions], dtype=np.float64).reshape(-1, 3)
+        start = len(self._P)
+        self._P = np.vstack([self._P, pos])
+        for k in self._pattr:
+            self._pattr[k].extend([self._pdefault[k]] * len(pos))
+        return tuple(Point(self, i) for i in range(start, len(self._P)))
+
+    def points(self):
+        return tuple(Point(self, i) for i in range(len(self._P)))
+
+    def prims(self):
+        return tuple(Prim(self, i) for i in range(len(self._prims)))
+
+    def iterPoints(self):
+        return self.points()
+
+    def iterPrims(self):
+        return self.prims()
+
+    def createPolygon(self, is_closed=True):
+        self._check()
+        self._prims.append([])
+        return Prim(self, len(self._prims) - 1)
+
+    def createPolygons(self, points, is_closed=True):
+        self._check()
+        start = len(self._prims)
+        for p in points:
+            self._prims.append([int(x) if not isinstance(x, Point) else x.number() for x in p])
+        return tuple(Prim(self, i) for i in range(start, len(self._prims)))
+
+    def deletePrims(self, prims, keep_points=False):
+        self._check()
+        nums = set(p.number() for p in prims)
+        dropped = set(x for i, p in enumerate(self._prims) if i in nums for x in p)
+        self._prims = [p for i, p in enumerate(self._prims) if i not in nums]
+        if not keep_points:
+            used = set(x for p in self._prims for x in p)
+            gone = sorted(dropped - used)
+            if gone:
+                remap = {}
+                keep = [i for i in range(len(self._P)) if i not in set(gone)]
+                for new, old in enumerate(keep):
+                    remap[old] = new
+                self.deletePoints([Point(self, i) for i in gone])
+                self._prims = [[remap[x] for x in p] for p in self._prims]
+
+    def prim(self, i):
+        return Prim(self, i)
+
+    def point(self, i):
+        return Point(self, i)
+
+    def deletePoints(self, points):
+        self._check()
+        nums = sorted(set(p.number() for p in points))
+        keep = np.ones(len(self._P), bool)
+        keep[nums] = False
+        self._P = self._P[keep]
+        for k in self._pattr:
+            self._pattr[k] = [v for v, kk in zip(self._pattr[k], keep) if kk]
+
+    def clear(self):
+        self._check()
+        self.__init__()
+
+    def setPointFloatAttribValues(self, name, values):
+        self._check()
+        vals = list(values)
+        if name == "P":
+            self._P = np.array(vals, dtype=np.float64).reshape(-1, 3)
+            return
+        d = self._pdefault[name]
+        size = len(d) if isinstance(d, (tuple, list)) else 1
+        if size == 1:
+            self._pattr[name] = vals
+        else:
+            self._pattr[name] = [tuple(vals[i:i + size]) for i in range(0, len(vals), size)]
+
+    def setPointFloatAttribValuesFromString(self, name, values, float_type=None):
+        arr = np.frombuffer(values, dtype=np.float32)
+        self.setPointFloatAttribValues(name, arr.tolist())
+
+    def primIntAttribValues(self, name):
+        return tuple(int(x) for x in self._primattr[name])
+
+    def primIntAttribValuesAsString(self, name, int_type=None):
+        return np.array(self._primattr[name], dtype=np.int32).tobytes()
+
+    def pointFloatAttribValues(self, name):
+        if name == "P":
+            return tuple(self._P.ravel().tolist())
+        out = []
+        for v in self._pattr[name]:
+            out.extend(v if isinstance(v, (tuple, list)) else [v])
+        return tuple(out)
+
+    def pointFloatAttribValuesAsString(self, name, float_type=None):
+        return np.array(self.pointFloatAttribValues(name), dtype=np.float32).tobytes()
+
+    def transform(self, matrix):
+        self._check()
+        h = np.hstack([self._P, np.ones((len(self._P), 1))])
+        r = np.dot(h, matrix._m)
+        self._P = r[:, :3] / r[:, 3:4]
+
+    def intersect(self, *args, **kwargs):
+        return -1
+
+
+class _Verb(object):
+    def __init__(self, name):
+        self.name = name
+        self.parms = {}
+
+    def setParms(self, parms):
+        self.parms = dict(parms)
+
+    def execute(self, geo, inputs):
+        p = self.parms
+        if self.name == "line":
+            geo.createPoints([(0, 0, 0), tuple(p.get('dir', (0, 1, 0)))])
+            geo.createPolygons([(0, 1)], False)
+        elif self.name in ("circle",):
+            divs = max(int(p.get('divs', 12)), 1)
+            pts = [(math.cos(2 * math.pi * i / divs), math.sin(2 * math.pi * i / divs), 0) for i in range(divs)]
+            geo.createPoints(pts)
+            geo.createPolygons([tuple(range(divs))])
+        elif self.name in ("tube", "sphere"):
+            cols = int(p.get('cols', 10))
+            pts = [(math.cos(2 * math.pi * i / cols), 0, math.sin(2 * math.pi * i / cols)) for i in range(cols)]
+            pts += [(x, 1, z) for x, _, z in pts]
+            geo.createPoints(pts)
+            geo.createPolygons([(i, (i + 1) % cols, cols + (i + 1) % cols, cols + i) for i in range(cols)])
+        elif self.name == "attribwrangle":
+            src = inputs[0]
+            g = src.freeze()
+            snip = p.get('snippet', '')
+            if '__ruler_prim' in snip:
+                g._primattr['__ruler_prim'] = list(range(len(g._prims)))
+            if '__ruler_p0' in snip:
+                for k in range(3):
+                    g._primattr['__ruler_p%d' % k] = [pr[k] if len(pr) == 3 else -1 for pr in g._prims]
+            g._primattr.update(dict((k, list(v)) for k, v in src._primattr.items() if k not in g._primattr))
+            geo._P, geo._pattr, geo._pdefault, geo._prims, geo._primattr = g._P, g._pattr, g._pdefault, g._prims, g._primattr
+        elif self.name == "divide":
+            src = inputs[0]
+            prims, attrs = [], dict((k, []) for k in src._primattr)
+            for i, pr in enumerate(src._prims):
+                tris = [[pr[0], pr[j], pr[j + 1]] for j in range(1, len(pr) - 1)] if len(pr) > 3 else [list(pr)]
+                for t in tris:
+                    prims.append(t)
+                    for k in attrs:
+                        attrs[k].append(src._primattr[k][i])
+            geo._P = src._P.copy()
+            geo._pattr = dict((k, list(v)) for k, v in src._pattr.items())
+            geo._pdefault = dict(src._pdefault)
+            geo._prims, geo._primattr = prims, attrs
+        elif self.name == "grid":
+            rows, cols = int(p.get('rows', 10)), int(p.get('cols', 10))
+            size = p.get('size', (10, 10))
+            xs = np.linspace(-size[0] / 2.0, size[0] / 2.0, cols)
+            zs = np.linspace(-size[1] / 2.0, size[1] / 2.0, rows)
+            X, Z = np.meshgrid(xs, zs)
+            pts = np.stack([X.ravel(), np.zeros(X.size), Z.ravel()], axis=1)
+            geo.createPoints(pts.tolist())
+            r = np.arange(rows - 1)[:, None] * cols
+            c = np.arange(cols - 1)[None, :]
+            a = (r + c).ravel()
+            quads = np.stack([a, a + 1, a + cols + 1, a + cols], axis=1)
+            geo.createPolygons(quads.tolist())
+
+
+SopVerb = _Verb
+
+
+class _Category(object):
+    def nodeVerb(self, name):
+        return _Verb(name)
+
+
+def sopNodeTypeCategory():
+    return _Category()
+
+
+class _Enum(object):
+    def __init__(self, *names):
+        for i, n in enumerate(names):
+            setattr(self, n, n)
+
+
+drawableGeometryType = _Enum("Line", "Point", "Face")
+drawableHighlightMode = _Enum("MatteOverGlow", "Glow", "Matte")
+drawableGeometryPointStyle = _Enum("SmoothCircle", "SmoothSquare")
+uiEventReason = _Enum("Start", "Active", "Changed", "Located", "Picked", "New")
+snappingMode = _Enum("Off", "Grid", "Prim", "Point", "Multi")
+geometryViewportType = _Enum("Perspective", "Top", "Bottom", "Front", "Back", "Left", "Right")
+parmTemplateType = _Enum("Menu", "Toggle", "Float", "Int", "String")
+playbarEvent = _Enum("FrameChanged", "Started", "Stopped")
+
+
+class _Stats(object):
+    """ Counts drawable calls so benchmarks can report them next to timings. """
+    calls = {}
+
+    @classmethod
+    def hit(cls, name):
+        cls.calls[name] = cls.calls.get(name, 0) + 1
+
+    @classmethod
+    def reset(cls):
+        cls.calls = {}
+
+
+class _Drawable(object):
+    def __init__(self, scene_viewer, *args):
+        _Stats.hit(type(self).__name__ + ".__init__")
+        self.visible = False
+        self.params = {}
+
+    def show(self, v):
+        _Stats.hit(type(self).__name__ + ".show")
+        self.visible = v
+
+    def setParams(self, params):
+        _Stats.hit(type(self).__name__ + ".setParams")
+        self.params.update(params)
+
+    def draw(self, handle, params=None):
+        _Stats.hit(type(self).__name__ + ".draw")
+
+    def setTransform(self, xform):
+        self.xform = xform
+
+
+class GeometryDrawable(_Drawable):
+    def __init__(self, scene_viewer, geo_type, name, geometry=None, params=None):
+        _Drawable.__init__(self, scene_viewer)
+        self.geometry = geometry
+
+    def setGeometry(self, geo):
+        _Stats.hit("GeometryDrawable.setGeometry")
+        self.geometry = geo
+
+
+class TextDrawable(_Drawable):
+    def __init__(self, scene_viewer, name, params=None):
+        _Drawable.__init__(self, scene_viewer)
+
+
+class _Hotkeys(object):
+    def __init__(self):
+        self.cmds = {}
+
+    def addContext(self, *a):
+        pass
+
+    def addCommand(self, name, label, desc, keys):
+        self.cmds[name] = keys
+
+    def assignments(self, name):
+        return tuple(self.cmds.get(name, ["?"]))
+
+    def isKeyMatch(self, key, name):
+        return key in self.cmds.get(name, ())
+
+
+hotkeys = _Hotkeys()
+
+
+class GeometryViewport(object):
+    def __init__(self):
+        self.cam = Matrix4(1.0)
+        self.cam._m[3, 2] = 10.0
+        proj = np.identity(4)
+        proj[0, 0] = proj[1, 1] = 1.5
+        proj[2, 3] = -1.0
+        proj[3, 3] = 0.0
+        proj[3, 2] = -0.2
+        self.proj = Matrix4(proj)
+
+    def cameraToModelTransform(self):
+        return self.cam
+
+    def ndcToCameraTransform(self):
+        return self.proj.inverted()
+
+    def _ndcToViewport(self):
+        m = np.identity(4)
+        m[0, 0], m[1, 1] = 960, 540
+        m[3, 0], m[3, 1] = 960, 540
+        return Matrix4(m)
+
+    def viewportToNDCTransform(self):
+        return self._ndcToViewport().inverted()
+
+    def size(self):
+        return (0, 0, 1920, 1080)
+
+    def mapToScreen(self, pos):
+        m = self.cam.inverted() * self.proj.inverted().inverted() * self._ndcToViewport()
+        v = Vector3(pos) * m
+        return Vector2(v[0], v[1])
+
+    def type(self):
+        return geometryViewportType.Perspective
+
+    def draw(self):
+        _Stats.hit("GeometryViewport.draw")
+
+
+class SceneViewer(object):
+    def __init__(self):
+        self.vp = GeometryViewport()
+        self.prompt = None
+
+    def curViewport(self):
+        return self.vp
+
+    def setPromptMessage(self, msg, *a):
+        self.prompt = msg
+
+    def clearPromptMessage(self):
+        self.prompt = None
+
+    def snappingMode(self):
+        return snappingMode.Off
+
+    node = None
+
+    def pwd(self):
+        return SceneViewer.node
+
+
+class ViewerStateTemplate(object):
+    def __init__(self, *a):
+        self.parms = []
+
+    def bindFactory(self, f):
+        self.factory = f
+
+    def bindIcon(self, i):
+        pass
+
+    def bindParameter(self, *a, **k):
+        self.parms.append(k)
+
+
+severityType = _Enum("Message", "ImportantMessage", "Warning", "Error", "Fatal")
+
+
+class ui(object):
+    clip = None
+    status = None
+
+    @staticmethod
+    def setStatusMessage(m, severity=None):
+        ui.status = m
+
+    @staticmethod
+    def copyTextToClipboard(t):
+        ui.clip = t
+
+    loop_callbacks = []
+    select_result = "" #what selectFile returns, set by the caller
+
+    @staticmethod
+    def addEventLoopCallback(cb):
+        ui.loop_callbacks.append(cb)
+
+    @staticmethod
+    def removeEventLoopCallback(cb):
+        ui.loop_callbacks.remove(cb)
+
+    @staticmethod
+    def runEventLoopCallbacks():
+        for cb in list(ui.loop_callbacks):
+            cb()
+
+    @staticmethod
+    def selectFile(**kwargs):
+        return ui.select_result
+
+
+class _Playbar(object):
+    range = (1.0, 24.0)
+
+    def frameRange(self):
+        return _Playbar.range
+
+    def addEventCallback(self, cb):
+        pass
+
+    def removeEventCallback(self, cb):
+        pass
+
+
+playbar = _Playbar()
+
+
+_frame = [1.0]
+
+
+def frame():
+    return _frame[0]
+
+
+def setFrame(f):
+    _frame[0] = float(f)
+
+
+def time():
+    return 0.0
+
+
+def fps():
+    return 24.0
+
+
+class _Device(object):
+    def __init__(self, x=0, y=0, key=None, ctrl=False, down=False, up=False):
+        self.x, self.y, self.key, self.ctrl, self.down, self.up = x, y, key, ctrl, down, up
+
+    def mouseX(self):
+        return self.x
+
+    def mouseY(self):
+        return self.y
+
+    def isKeyPressed(self):
+        return self.key is not None
+
+    def keyString(self):
+        return self.key
+
+    def isKeyDown(self):
+        return self.down
+
+    def isKeyUp(self):
+        return self.up
+
+    def isCtrlKey(self):
+        return self.ctrl
+
+
+class UIEvent(object):
+    def __init__(self, reason=None, origin=(0, 5, 10), direction=(0, -0.5, -1), x=0, y=0, **kw):
+        self._reason = reason
+        self._origin = Vector3(origin)
+        self._dir = Vector3(direction).normalized()
+        self._device = _Device(x, y, **kw)
+
+    def reason(self):
+        return self._reason
+
+    def device(self):
+        return self._device
+
+
+class ViewerEvent(UIEvent):
+    def ray(self):
+        return self._origin, self._dir
+
+    def snappingRay(self):
+        return {"origin_point": self._origin, "direction": self._dir}
+
+
+class FloatParmTemplate(object):
+    def __init__(self, name, label, num_components):
+        self._name = name
+
+
+class Keyframe(object):
+    def __init__(self, value=0.0):
+        self._value, self._frame = value, 0.0
+
+    def setFrame(self, f):
+        self._frame = f
+
+
+class Parm(object):
+    def __init__(self):
+        self.keys = {} #frame -> value
+
+    def setKeyframes(self, keys):
+        for k in keys:
+            self.keys[k._frame] = k._value
+
+
+class Node(object):
+    def __init__(self, path="/obj/geo1"):
+        self._path = path
+        self._cook = 1
+
+    def cookCount(self):
+        return self._cook
+
+    def parent(self):
+        return _network(self._path.rsplit("/", 1)[0] or "/")
+
+    def node(self, name):
+        return _nodes.get(self._path.rstrip("/") + "/" + name)
+
+    def createNode(self, type_name, name):
+        node = Node(self._path.rstrip("/") + "/" + name)
+        _nodes[node._path] = node
+        return node
+
+    def parm(self, name):
+        return self.__dict__.get("_parms", {}).get(name)
+
+    def addSpareParmTuple(self, template):
+        self.__dict__.setdefault("_parms", {})[template._name] = Parm()
+
+    def path(self):
+        return self._path
+
+    def setUserData(self, k, v):
+        self.__dict__.setdefault("_ud", {})[k] = v
+
+    def userData(self, k):
+        return self.__dict__.get("_ud", {}).get(k)
+
+    def destroyUserData(self, k, must_exist=True):
+        self.__dict__.get("_ud", {}).pop(k, None)
+
+
+class SopNode(Node):
+    def __init__(self, geo=None, path="/obj/geo1/OUT", deform=None):
+        if geo is None:
+            geo = Geometry()
+            v = _Verb("grid")
+            v.setParms({'rows': 40, 'cols': 40, 'size': (20, 20)})
+            v.execute(geo, [])
+        self._geo = geo
+        self._path = path
+        self._cook = 1
+        self._deform = deform #deform(rest positions, frame) animates the points
+        self._rest = geo._P.copy()
+        self._cooked_frame = None
+        _nodes[path] = self
+
+    def geometry(self):
+        if self._deform is not None and self._cooked_frame != _frame[0]:
+            self._geo._P = self._deform(self._rest, _frame[0])
+            self._cooked_frame = _frame[0]
+            self._cook += 1
+        return self._geo
+
+    def displayNode(self):
+        return self
+
+    def path(self):
+        return self._path
+
+    def cookCount(self):
+        return self._cook
+
+
+class PermissionError(Error):
+    pass
+
+
+class OperationFailed(Error):
+    pass
+
+
+_nodes = {} #path -> node, filled as nodes are made
+
+
+def _network(path):
+    return _nodes.get(path) or _nodes.setdefault(path, Node(path))
+
+
+def node(path):
+    return _nodes.get(path)
+
+
+class hipFile(object):
+    """ The "hip file" is a Python script that builds the scene, e.g. a 
+        SopNode with a deform function, which load runs.
+    """
+    _path = "untitled.hip"
+
+    @staticmethod
+    def path():
+        return hipFile._path
+
+    @staticmethod
+    def hasUnsavedChanges():
+        return False
+
+    @staticmethod
+    def load(path, suppress_save_prompt=False, ignore_load_warnings=False):
+        hipFile._path = path
+        with open(path) as f:
+            exec(compile(f.read(), path, "exec"), {"hou": sys.modules[__name__]})
+
+
+def expandString(s):
+    return s.replace("$HIP", os.path.join(tempfile.gettempdir(), "fakehip"))
+
+
+fileChooserMode = _Enum("Read", "Write", "ReadAndWrite")
@@ -0,0 +1,52 @@
+"""
+Module:         viewerstate.utils stand-in for offline benchmarks
+Description:    GeometryIntersector implemented as a brute force numpy ray 
+                cast over every triangle of the fan-triangulated polygons.
+"""
+import numpy as np
+import hou
+
+
+class GeometryIntersector(object):
+    def __init__(self, geometry, scene_viewer=None, tolerance=0.01):
+        self.geometry = geometry
+        self.scene_viewer = scene_viewer
+        tris = [(p[0], p[j], p[j + 1]) for p in geometry._prims for j in range(1, len(p) - 1)]
+        self.prims = np.array([i for i, p in enumerate(geometry._prims) for j in range(1, len(p) - 1)], dtype=np.int64)
+        corners = geometry._P[np.array(tris, dtype=np.int64).reshape(-1, 3)]
+        self.v0 = corners[:, 0]
+        self.e1 = corners[:, 1] - self.v0
+        self.e2 = corners[:, 2] - self.v0
+        self.reset()
+
+    def reset(self):
+        self.intersected = False
+        self.position = hou.Vector3()
+        self.normal = hou.Vector3()
+        self.uvw = hou.Vector3()
+        self.prim_num = -1
+        self.snapped = False
+        self.snapped_position = hou.Vector3()
+
+    def intersect(self, origin, ray, snap=True):
+        self.reset()
+        o = np.array(list(origin), dtype=np.float64)
+        d = np.array(list(ray), dtype=np.float64)
+        p = np.cross(d, self.e2)
+        det = (self.e1 * p).sum(axis=1)
+        ok = np.abs(det) > 1e-12
+        inv = np.where(ok, 1.0 / np.where(ok, det, 1.0), 0.0)
+        s = o - self.v0
+        u = (s * p).sum(axis=1) * inv
+        q = np.cross(s, self.e1)
+        v = (q * d).sum(axis=1) * inv
+        t = (self.e2 * q).sum(axis=1) * inv
+        hit = ok & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+        if not hit.any():
+            return False
+        best = np.flatnonzero(hit)[t[hit].argmin()]
+        self.intersected = True
+        self.position = hou.Vector3((o + d * t[best]).tolist())
+        self.uvw = hou.Vector3(u[best], v[best], 0.0)
+        self.prim_num = int(self.prims[best])
+        return True
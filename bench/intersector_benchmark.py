@@ -0,0 +1,102 @@
+"""
+Benchmark:      Ruler geometry intersector
+Description:    Compares the ruler's MeasureEngine.intersect, casting all 
+                rays in one batch, against the stock 
+                viewerstate.utils.GeometryIntersector casting them one at a 
+                time on synthetic meshes.
+Usage:          hython bench/intersector_benchmark.py [grid rows ...]
+                PYTHONPATH=bench/fakehou python bench/intersector_benchmark.py
+                runs it against the offline hou stand-in instead.
+"""
+
+import os
+import sys
+import time
+import random
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hou
+import viewerstate.utils as su
+import ruler
+
+ray_count = 500
+
+def makeGrid(rows):
+    """ Bumpy grid of (rows - 1)^2 quads on the XZ plane. """
+    geo = hou.Geometry()
+    grid_verb = hou.sopNodeTypeCategory().nodeVerb("grid")
+    hou.SopVerb.setParms(grid_verb, {'size': (20, 20), 'rows': rows, 'cols': rows})
+    hou.SopVerb.execute(grid_verb, geo, [])
+    bumped = hou.Geometry()
+    wrangle_verb = hou.sopNodeTypeCategory().nodeVerb("attribwrangle")
+    hou.SopVerb.setParms(wrangle_verb, {'class': 2, 'snippet': '@P.y = sin(@P.x) * cos(@P.z);'})
+    hou.SopVerb.execute(wrangle_verb, bumped, [geo])
+    return bumped
+
+def makeRays(count, seed=0):
+    rng = random.Random(seed)
+    rays = []
+    for i in range(count):
+        origin = hou.Vector3(rng.uniform(-10, 10), 20, rng.uniform(-10, 10))
+        direction = hou.Vector3(rng.uniform(-0.2, 0.2), -1, rng.uniform(-0.2, 0.2)).normalized()
+        rays.append((origin, direction))
+    return rays
+
+def timeIntersector(intersector, rays):
+    hits = []
+    start = time.time()
+    for origin, direction in rays:
+        if intersector.intersect(origin, direction):
+            hits.append(hou.Vector3(intersector.position))
+        else:
+            hits.append(None)
+    return time.time() - start, hits
+
+def timeEngine(engine, rays):
+    origins = np.array([tuple(origin) for origin, direction in rays])
+    directions = np.array([tuple(direction) for origin, direction in rays])
+    start = time.time()
+    positions, planes = engine.intersect(origins, directions)
+    elapsed = time.time() - start
+    hits = [hou.Vector3(p.tolist()) if plane < 0 else None for p, plane in zip(positions, planes)]
+    return elapsed, hits
+
+def agreement(a, b, tolerance=1e-3):
+    same = 0
+    for x, y in zip(a, b):
+        if x == None or y == None:
+            same += (x == None) == (y == None)
+        else:
+            same += x.distanceTo(y) < tolerance
+    return float(same) / len(a)
+
+def run(rows):
+    geo = makeGrid(rows)
+    rays = makeRays(ray_count)
+
+    start = time.time()
+    stock = su.GeometryIntersector(geo)
+    stock_build = time.time() - start
+
+    start = time.time()
+    engine = ruler.MeasureEngine.fromGeometry(geo)
+    bvh_build = time.time() - start
+
+    stock_time, stock_hits = timeIntersector(stock, rays)
+    bvh_time, bvh_hits = timeEngine(engine, rays)
+    print("{:>10} {:>10.3f} {:>10.3f} {:>12.3f} {:>12.3f} {:>8.1%}".format(
+        len(geo.prims()), stock_build, bvh_build,
+        stock_time / ray_count * 1000, bvh_time / ray_count * 1000, agreement(stock_hits, bvh_hits)))
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [100, 300, 1000, 2000]
+    print("{:>10} {:>10} {:>10} {:>12} {:>12} {:>8}".format(
+        "prims", "stock s", "bvh s", "stock ms/ray", "bvh ms/ray", "agree"))
+    for rows in sizes:
+        run(rows)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
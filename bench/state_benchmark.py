@@ -0,0 +1,146 @@
+"""
+Benchmark:      Ruler viewer state hot paths
+Description:    Times module import and first state entry, disk building, 
+                measurement construction, container draws and synthetic 
+                mouse drags at 1, 100 and 1000 measurements
+                against the hou stand-in in bench/fakehou, so it runs on any
+                machine with numpy. The stand-in's geometry ops are slow Python,
+                so the numbers are for comparing revisions, not for absolute
+                Houdini timings.
+Usage:          python bench/state_benchmark.py [measurement counts ...]
+"""
+
+import os
+import sys
+import time
+import subprocess
+import py_compile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+sys.path.insert(0, os.path.join(here, "fakehou"))
+
+import numpy as np
+import hou
+import ruler
+
+repeats = 5
+drag_events = 60
+
+def best(function, calls):
+    """ Best mean seconds per call of function over repeats runs of calls. """
+    times = []
+    for r in range(repeats):
+        start = time.time()
+        for i in range(calls):
+            function()
+        times.append((time.time() - start) / calls)
+    return min(times)
+
+def report(name, count, seconds, extra=""):
+    print("{:<28} {:>6} {:>12.4f} ms  {}".format(name, count, seconds * 1000, extra))
+
+def makeState(count, seed=0):
+    """ State on the stand-in's grid with count committed measurements. """
+    hou.SceneViewer.node = hou.SopNode()
+    state = ruler.State("mb::ruler", hou.SceneViewer())
+    state.onGenerate({})
+    rng = np.random.RandomState(seed)
+    tails = rng.uniform(-8, 8, (count, 3))
+    heads = tails + rng.uniform(-2, 2, (count, 3))
+    colors = np.arange(count) % len(ruler.MeasurementContainer.getColors())
+    state.measurements.restore(ruler.MeasurementStore.fromArrays(tails, heads, colors=colors))
+    state.onResume({})
+    return state
+
+def waitForIndex(state):
+    for i in range(200):
+        state.refreshIntersector()
+        if not state.indexing:
+            return
+        time.sleep(0.01)
+
+def mouseEvent(reason, x):
+    return {"ui_event": hou.ViewerEvent(reason, origin=(x, 5, 10), x=x * 10, y=5)}
+
+startup_script = """
+import sys, time
+sys.path[:0] = {path!r}
+import hou
+start = time.time()
+import ruler
+imported = time.time()
+modules = "numpy" in sys.modules
+ruler.createViewerStateTemplate()
+registered = time.time()
+hou.SceneViewer.node = hou.SopNode()
+ruler.State("mb::ruler", hou.SceneViewer())
+entered = time.time()
+print(imported - start, registered - imported, entered - registered, modules)
+"""
+
+def benchStartup():
+    """ Import and first entry costs, each run in a fresh interpreter since 
+        both only happen once per session. The stand-in hou is imported 
+        first and not counted.
+    """
+    py_compile.compile(ruler.__file__.replace(".pyc", ".py")) #time loading bytecode, not compiling the source
+    runs = []
+    script = startup_script.format(path=[os.path.join(here, "fakehou"), os.path.join(here, "..")])
+    for r in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", script])
+        runs.append(output.decode("ascii").split())
+    imports, templates, entries = [min(float(run[i]) for run in runs) for i in range(3)]
+    report("import ruler", 1, imports, "numpy imported" if runs[0][3] == "True" else "numpy not imported")
+    report("createViewerStateTemplate", 1, templates)
+    report("first State()", 1, entries)
+
+def benchDisk():
+    maker = ruler.DiskMaker(10, 8, 20, (1.0, 1.0, 1.0), 3)
+    report("DiskMaker.makeDisk", 1, best(lambda: maker.makeDisk((0, 1, 0), (.2, .7, .2)), 20))
+
+def benchMeasurement():
+    drawables = ruler.MeasurementDrawables(hou.SceneViewer(), 1.0)
+    color = ruler.MeasurementContainer.getColors()[0]
+    report("Measurement.__init__", 1, best(lambda: ruler.Measurement(color, True, drawables), 1000))
+
+def benchDraw(count):
+    state = makeState(count)
+    container = state.measurements
+    viewport = state.geometry_viewport
+    report("container draw, still", count, best(lambda: container.draw(None, state.view), 50))
+    def moving():
+        viewport.cam._m[3, 0] += 1e-4 #any camera change redoes the visibility pass
+        state.view.update()
+        container.draw(None, state.view)
+    report("container draw, moving", count, best(moving, 50), "{} labels".format(len(container.labels)))
+
+def benchDrag(count):
+    state = makeState(count)
+    waitForIndex(state)
+    state.scheduler.interval = 0.0 #time every event instead of coalescing
+    def drag():
+        state.onMouseEvent(mouseEvent(hou.uiEventReason.Start, 0.0))
+        for i in range(drag_events):
+            state.onMouseEvent(mouseEvent(hou.uiEventReason.Active, i * 0.05))
+            state.onDraw({"draw_handle": None})
+        state.onMouseEvent(mouseEvent(hou.uiEventReason.Changed, drag_events * 0.05))
+        state.removeMeasurement()
+    hou._Stats.reset()
+    seconds = best(drag, 1) / drag_events
+    calls = sum(hou._Stats.calls.values()) // (repeats * drag_events)
+    report("drag event + draw", count, seconds, "{} hou drawable calls".format(calls))
+
+def main(argv):
+    counts = [int(a) for a in argv] or [1, 100, 1000]
+    print("{:<28} {:>6} {:>15}".format("benchmark", "count", "per call"))
+    benchStartup()
+    benchDisk()
+    benchMeasurement()
+    for count in counts:
+        benchDraw(count)
+    for count in counts:
+        benchDrag(count)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
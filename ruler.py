@@ -7,21 +7,68 @@ Date Created:   March 24, 2020 - 11:28:31
 """
 
 import hou
-import viewerstate.utils as su
 import math as m
+import threading
+import time
+import base64
+import os
+import json
+import sys
+import bisect
+import importlib
+import collections
+
+try:
+    import hdefereval
+except ImportError: #not available without the UI, e.g. in hython
+    hdefereval = None
+
+class LazyModule(object):
+    """ Placeholder for a module imported on first attribute access. The 
+        import then replaces the placeholder in this module's globals, so 
+        later lookups go straight to the real module. Houdini imports every 
+        state file at startup, and this keeps numpy out of that.
+    """
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module
+        return getattr(module, attr)
+
+np = LazyModule("numpy", "np")
+subprocess = LazyModule("subprocess", "subprocess") #only the frame range sampler starts processes
 
 key_context = "h.pane.gview.state.sop.mb::ruler"
-hou.hotkeys.addContext(
-        key_context, "Ruler State Operation", "These keys apply to the Ruler state operation.")
 
 class Key():
     copy_to_clip = key_context + ".copy_to_clip"
     undo = key_context + ".undo"
     pop_copy = key_context + ".pop_copy"
-
-hou.hotkeys.addCommand(Key.copy_to_clip, "Copy", "Copy last measurement to clip board.", ["q",])
-hou.hotkeys.addCommand(Key.undo, "Undo", "Remove last measurement.", ["z",])
-hou.hotkeys.addCommand(Key.pop_copy, "PopCopy", "Copy last measurement and remove it.", ["f",])
+    export = key_context + ".export"
+    profile_report = key_context + ".profile_report"
+    sample_range = key_context + ".sample_range"
+    finish_shape = key_context + ".finish_shape"
+    registered = False
+
+    @staticmethod
+    def register():
+        """ Add the hotkey context and commands the first time the state is 
+            used in a session.
+        """
+        if Key.registered: return
+        Key.registered = True
+        hou.hotkeys.addContext(
+                key_context, "Ruler State Operation", "These keys apply to the Ruler state operation.")
+        hou.hotkeys.addCommand(Key.copy_to_clip, "Copy", "Copy last measurement to clip board.", ["q",])
+        hou.hotkeys.addCommand(Key.undo, "Undo", "Remove last measurement.", ["z",])
+        hou.hotkeys.addCommand(Key.pop_copy, "PopCopy", "Copy last measurement and remove it.", ["f",])
+        hou.hotkeys.addCommand(Key.export, "Export", "Export all measurements to a CSV, JSON or .npy file.", ["e",])
+        hou.hotkeys.addCommand(Key.profile_report, "ProfileReport", "Copy the profiling report to the clip board.", ["p",])
+        hou.hotkeys.addCommand(Key.sample_range, "SampleRange", "Measure all measurements over the playbar frame range.", ["r",])
+        hou.hotkeys.addCommand(Key.finish_shape, "FinishShape", "Finish the polyline or area being picked.", ["Enter",])
 
 def createSphereGeometry():
     geo = hou.Geometry()
@@ -69,6 +116,39 @@ def createArcGeometry(angle, radius):
     hou.SopVerb.execute(circle_verb, geo, [])
     return geo
 
+template_cache = {}
+
+def templateKey(builder):
+    """ builder as a cache key that stays the same while the Profiler has it 
+        wrapped. Bound methods keep their instance.
+    """
+    function = getattr(builder, '__func__', builder)
+    return (getattr(builder, '__self__', None), getattr(function, '__wrapped__', function))
+
+def getTemplateGeometry(builder, *args):
+    """ Return the read-only geometry produced by builder(*args), building it 
+        the first time it is requested. The result is shared by every drawable 
+        that asks for the same builder and arguments, so it must never be 
+        modified in place.
+    """
+    key = (templateKey(builder),) + args
+    geo = template_cache.get(key)
+    if geo is None:
+        geo = hou.Geometry.freeze(builder(*args), True)
+        template_cache[key] = geo
+    return geo
+
+def invalidateTemplateGeometry(builder=None):
+    """ Drop cached templates made by builder, or all of them if builder is None. 
+        Drawables already holding a template keep their copy.
+    """
+    if builder is None:
+        template_cache.clear()
+        return
+    builder_key = templateKey(builder)
+    for key in [k for k in template_cache if k[0] == builder_key]:
+        del template_cache[key]
+
 class DiskMaker(object):
     def __init__(self, radius, divs, arcs, color, gamma):
         self.parms = {"radius": radius, "divs":divs, "arcs":arcs, "geo":None, "color": color, "gamma":gamma}
@@ -78,57 +158,40 @@ class DiskMaker(object):
         hou.Geometry.addAttrib(geo, hou.attribType.Point, "Alpha", 1.0)
         
     def makePoints(self, geo, r, divs, arcs, color, gamma):
+        """ Compute every point position, Cd and Alpha in one pass and push
+            them to the geometry with the bulk setters.
+        """
         self.createAttribs(geo)
-        pi = m.pi
-        arc_len = 2 * pi / arcs
-        div_len = r / float(divs)
-        
-        point0 = hou.Geometry.createPoint(geo)
-        hou.Point.setAttribValue(point0, "Cd", color)
-        hou.Point.setAttribValue(point0, "Alpha", 1.0)
-        for i in range(1, divs):
-            alpha = pow(1 - (float(i) / divs), gamma)
-            for j in range(arcs):
-                point = hou.Geometry.createPoint(geo)
-                pos = hou.Vector3(m.cos(j * arc_len), m.sin(j * arc_len), 0.0) * i * div_len
-                hou.Point.setPosition(point, pos)
-                hou.Point.setAttribValue(point, "Cd", color)
-                hou.Point.setAttribValue(point, "Alpha", alpha)
+        rings = np.arange(1, divs, dtype=np.float64)
+        angles = np.arange(arcs) * (2 * m.pi / arcs)
+        radii = rings * (r / float(divs))
+        count = 1 + (divs - 1) * arcs
+
+        pos = np.zeros((count, 3))
+        pos[1:, 0] = np.outer(radii, np.cos(angles)).ravel()
+        pos[1:, 1] = np.outer(radii, np.sin(angles)).ravel()
+        alpha = np.ones(count)
+        alpha[1:] = np.repeat(np.power(1 - rings / divs, gamma), arcs)
+        cd = np.tile(np.asarray(color, dtype=np.float64), (count, 1))
+
+        hou.Geometry.createPoints(geo, pos.tolist())
+        hou.Geometry.setPointFloatAttribValues(geo, "Cd", cd.ravel().tolist())
+        hou.Geometry.setPointFloatAttribValues(geo, "Alpha", alpha.tolist())
                 
     def makeFirstRing(self, geo, arcs):
-        points = hou.Geometry.points(geo)
-        for i in range(1, arcs):
-            prim = hou.Geometry.createPolygon(geo)
-            hou.Polygon.addVertex(prim, points[0])
-            hou.Polygon.addVertex(prim, points[i])
-            hou.Polygon.addVertex(prim, points[i+1])
-        prim = hou.Geometry.createPolygon(geo)
-        hou.Polygon.addVertex(prim, points[0])
-        hou.Polygon.addVertex(prim, points[arcs])
-        hou.Polygon.addVertex(prim, points[1])
+        cur = np.arange(1, arcs + 1)
+        tris = np.column_stack((np.zeros(arcs, dtype=int), cur, cur % arcs + 1))
+        hou.Geometry.createPolygons(geo, tris.tolist())
         
     def makeOtherRings(self, geo, arcs, divs):
-        points = hou.Geometry.points(geo)
-        for i in range(1, divs - 1):
-            for j in range(1, arcs):
-                p0 = points[ j + arcs * (i - 1) ]
-                p3 = points[ j + 1 + arcs * (i - 1) ]
-                p1 = points[ j + arcs * i ]
-                p2 = points[ j + 1 + arcs * i ]
-                prim = hou.Geometry.createPolygon(geo)
-                hou.Polygon.addVertex(prim, p0)
-                hou.Polygon.addVertex(prim, p1)
-                hou.Polygon.addVertex(prim, p2)
-                hou.Polygon.addVertex(prim, p3)
-            p0 = points[ arcs + arcs * (i - 1) ]
-            p3 = points[ 1 + arcs * (i - 1) ]
-            p1 = points[ arcs + arcs * i ]
-            p2 = points[ 1 + arcs * i ]
-            prim = hou.Geometry.createPolygon(geo)
-            hou.Polygon.addVertex(prim, p0)
-            hou.Polygon.addVertex(prim, p1)
-            hou.Polygon.addVertex(prim, p2)
-            hou.Polygon.addVertex(prim, p3)
+        if divs < 3:
+            return
+        cur = np.arange(1, arcs + 1)
+        nxt = cur % arcs + 1
+        inner = (np.arange(divs - 2) * arcs)[:, None]
+        outer = inner + arcs
+        quads = np.stack((cur + inner, cur + outer, nxt + outer, nxt + inner), axis=-1)
+        hou.Geometry.createPolygons(geo, quads.reshape(-1, 4).tolist())
                 
     def makePrims(self, geo, arcs, divs):
         self.makeFirstRing(geo, arcs)
@@ -147,6 +210,16 @@ class DiskMaker(object):
     def setColor(self, color):
         self.parms["color"] = color
 
+    def setParm(self, name, value):
+        """ Change a generator parameter (radius, divs, arcs or gamma). Disks 
+            cached from the old value are invalidated.
+        """
+        self.parms[name] = value
+        invalidateTemplateGeometry(self.makeDisk)
+
+    def getDisk(self, direction, color):
+        return getTemplateGeometry(self.makeDisk, tuple(direction), tuple(color))
+
     def makeDisk(self, direction, color):
         self.setColor(color)
         geo = hou.Geometry()
@@ -163,14 +236,15 @@ class Color(object):
     pink = 3
 
     colorMap = {
-        pink   : (hou.Vector4(1.0, 0.4745, 0.77647, 1),       "#ff79c6"),
-        yellow : (hou.Vector4(0.9450, 0.9804, 0.54902, 1),    "#f1fa8c"),
-        purple : (hou.Vector4(0.74118, 0.57647, 0.97647, 1),  "#bd93f9"),
-        green  : (hou.Vector4(0.31372, 0.980392, 0.48235, 1), "#50fa7b"),
+        pink   : ((1.0, 0.4745, 0.77647, 1),       "#ff79c6"),
+        yellow : ((0.9450, 0.9804, 0.54902, 1),    "#f1fa8c"),
+        purple : ((0.74118, 0.57647, 0.97647, 1),  "#bd93f9"),
+        green  : ((0.31372, 0.980392, 0.48235, 1), "#50fa7b"),
         }
 
     def __init__(self, color):
-        self.vector4, self.hex_str = Color.colorMap[color]
+        rgba, self.hex_str = Color.colorMap[color]
+        self.vector4 = hou.Vector4(rgba)
 
     def getVec(self):
         return self.vector4
@@ -181,11 +255,68 @@ class Color(object):
     def getHexStr(self):
         return self.hex_str
 
-def getCameraCancellingScale(translate, model_to_camera, camera_to_ndc, value):
-    model_to_ndc = translate * model_to_camera * camera_to_ndc 
+class ViewTransforms(object):
+    """ Camera matrices of a viewport, inverted once per camera change.
+        update() compares the raw viewport transforms against the ones seen 
+        last time, so a still camera costs no inversions.
+    """
+    def __init__(self, viewport):
+        self.viewport = viewport
+        self.raw = None
+        self.version = 0 #bumped on every camera change
+        self.model_to_camera = None
+        self.camera_to_ndc = None
+        self.model_to_ndc = None
+        self.model_to_screen = None
+        self.size = None
+        self.update()
+
+    def update(self):
+        """ Refresh the cached matrices. Returns True if the camera changed.
+        """
+        camera_to_model = hou.GeometryViewport.cameraToModelTransform(self.viewport)
+        ndc_to_camera = hou.GeometryViewport.ndcToCameraTransform(self.viewport)
+        screen_to_ndc = hou.GeometryViewport.viewportToNDCTransform(self.viewport)
+        size = hou.GeometryViewport.size(self.viewport)
+        raw = (camera_to_model.asTuple(), ndc_to_camera.asTuple(), screen_to_ndc.asTuple(), tuple(size))
+        if raw == self.raw:
+            return False
+        self.raw = raw
+        self.version += 1
+        self.model_to_camera = camera_to_model.inverted()
+        self.camera_to_ndc = ndc_to_camera.inverted()
+        self.model_to_ndc = self.model_to_camera * self.camera_to_ndc
+        self.model_to_screen = np.array((self.model_to_ndc * screen_to_ndc.inverted()).asTuple()).reshape(4, 4)
+        self.size = (size[2], size[3])
+        return True
+
+    def pixelRadius(self, pixels):
+        """ World space size of a screen space radius, as (a, b) such that the 
+            radius at distance t from the camera is a + b * t.
+        """
+        scale = 2.0 * pixels / (abs(self.camera_to_ndc.at(0, 0)) * self.size[0])
+        if self.camera_to_ndc.at(2, 3) == 0: #orthographic
+            return scale, 0.0
+        return 0.0, scale
+
+    def toScreen(self, positions):
+        """ Vectorized mapToScreen for an (n, 3) array of world positions. 
+            Returns the (n, 2) screen positions and a mask of the points that 
+            are in front of the camera.
+        """
+        homogeneous = np.ones((len(positions), 4))
+        homogeneous[:, :3] = positions
+        projected = np.dot(homogeneous, self.model_to_screen)
+        w = projected[:, 3]
+        in_front = w > 0
+        screen = projected[:, :2] / np.where(in_front, w, 1.0)[:, None]
+        return screen, in_front
+
+def getCameraCancellingScale(translate, view, value):
+    model_to_ndc = translate * view.model_to_ndc
     w = model_to_ndc.at(3, 3)
     if (w == 1): 
-        w = 2 / abs(camera_to_ndc.at(0,0)) #scale ~* orthowidth
+        w = 2 / abs(view.camera_to_ndc.at(0,0)) #scale ~* orthowidth
     w *= value 
     scale = hou.hmath.buildScale(w, w, w)
     return scale
@@ -193,47 +324,198 @@ def getCameraCancellingScale(translate, model_to_camera, camera_to_ndc, value):
 class Plane:
     X, Y, Z = range(0, 3)
 
-class Measurement(object):
-    default_font_size = 18.0
-    default_text = "default text"
-    disk_maker = DiskMaker(10, 8, 20, (1.0, 1.0, 1.0), 3)
-
-    def __init__(self, scene_viewer, color, show_text, text_scale):
-        line = createLineGeometry()
-        frustum = createFrustumGeometry()
-        self.color = color
-        self.disk_x = Measurement.disk_maker.makeDisk((1, 0, 0), (.7, .2, .2))
-        self.disk_y = Measurement.disk_maker.makeDisk((0, 1, 0), (.2, .7, .2))
-        self.disk_z = Measurement.disk_maker.makeDisk((0, 0, 1), (.2, .2, .7))
+class LabelCache(object):
+    """ Bounded LRU of label HTML keyed on (rounded value, font size, Color). 
+        A label only changes when its rounded length does, so most updates 
+        are a dict hit instead of a format.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def get(self, value, font_size, color):
+        key = (value, font_size, color)
+        label = self.entries.pop(key, None)
+        if label == None:
+            label = Measurement.formatText(str(value), font_size, color.getHexStr())
+            if len(self.entries) >= self.size:
+                self.entries.popitem(False)
+        self.entries[key] = label
+        return label
+
+label_cache = LabelCache(256)
+
+class MeasurementDrawables(object):
+    """ Drawables and parameter dicts used to render a measurement while it 
+        is drawn out. The container creates one set and attaches it to each 
+        new measurement in turn, so starting a measurement allocates nothing 
+        on the Houdini side. Disk drawables are pooled per plane.
+    """
+    disk_maker = None #created on first use
+    spot_size = 0.01
+
+    @staticmethod
+    def getDiskMaker():
+        if MeasurementDrawables.disk_maker == None:
+            MeasurementDrawables.disk_maker = DiskMaker(10, 8, 20, (1.0, 1.0, 1.0), 3)
+        return MeasurementDrawables.disk_maker
+
+    def __init__(self, scene_viewer, text_scale):
+        line = getTemplateGeometry(createLineGeometry)
+        frustum = getTemplateGeometry(createFrustumGeometry)
         self.scene_viewer = scene_viewer
         self.tail_spot_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "tail_spot", frustum)
         self.head_spot_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "head_spot", frustum)
         self.line_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "line", line)
         self.tail_disk_drawable = None
         self.head_disk_drawable = None
+        self.tail_disk_pool = [None, None, None]
+        self.head_disk_pool = [None, None, None]
         self.text_drawable = hou.TextDrawable(scene_viewer, "text_drawable")
-        self.text_params = {'text': None, 'translate': hou.Vector3(0.0, 0.0, 0.0), 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':10, 'color2':hou.Vector4(0,0,0,0.5), 'scale':hou.Vector3(text_scale, text_scale, text_scale)}
-        self.spot_params = {'color1': color.getVec(), 'fade_factor': 0.5,'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':5 }
-        self.line_params = {'line_width': 4.0, 'style': (10.0, 5.0), 'color1': color.getVec(),  'fade_factor':0.3, 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':5}
+        self.text = None #last text pushed to text_drawable, see setText
+        self.text_params = {'translate': hou.Vector3(0.0, 0.0, 0.0), 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':10, 'color2':hou.Vector4(0,0,0,0.5), 'scale':hou.Vector3(text_scale, text_scale, text_scale)}
+        self.spot_params = {'color1': None, 'fade_factor': 0.5,'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':5 }
+        self.line_params = {'line_width': 4.0, 'style': (10.0, 5.0), 'color1': None,  'fade_factor':0.3, 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':5}
+        self.visible = None #what the drawables were last shown as, None until the first show
+        self.text_visible = None
+
+    def setText(self, text):
+        """ Push text to the text drawable, only if it differs from what it 
+            already shows.
+        """
+        if text == self.text: return
+        self.text = text
+        hou.TextDrawable.setParams(self.text_drawable, {'text': text})
+
+    def bind(self, color):
+        """ Reset for a new measurement of the given Color. 
+        """
+        self.spot_params['color1'] = color.getVec()
+        self.line_params['color1'] = color.getVec()
+        self.clearDisks()
+
+    def disk(self, pool, plane):
+        """ Pooled disk drawable for plane. Picks up new disk geometry if the 
+            disk maker's parameters changed since it was created.
+        """
+        maker = MeasurementDrawables.getDiskMaker()
+        if plane == Plane.X: geometry = maker.getDisk((1, 0, 0), (.7, .2, .2))
+        if plane == Plane.Y: geometry = maker.getDisk((0, 1, 0), (.2, .7, .2))
+        if plane == Plane.Z: geometry = maker.getDisk((0, 0, 1), (.2, .2, .7))
+        if pool[plane] == None:
+            pool[plane] = (hou.GeometryDrawable(self.scene_viewer, hou.drawableGeometryType.Line, "circle", geometry), geometry)
+        drawable, current = pool[plane]
+        if current is not geometry:
+            hou.GeometryDrawable.setGeometry(drawable, geometry)
+            pool[plane] = (drawable, geometry)
+        return drawable
+
+    def setTailDisk(self, plane):
+        if plane not in (Plane.X, Plane.Y, Plane.Z):
+            return
+        drawable = self.disk(self.tail_disk_pool, plane)
+        if drawable is not self.tail_disk_drawable:
+            if self.tail_disk_drawable != None:
+                self.tail_disk_drawable.show(False)
+            self.tail_disk_drawable = drawable
+            drawable.show(self.visible == True)
+
+    def setHeadDisk(self, plane):
+        """ Switch the head disk to the pooled drawable for plane, creating it 
+            the first time that plane is used.
+        """
+        if plane not in (Plane.X, Plane.Y, Plane.Z):
+            return
+        drawable = self.disk(self.head_disk_pool, plane)
+        if drawable is not self.head_disk_drawable:
+            self.clearHeadDisk()
+            self.head_disk_drawable = drawable
+            drawable.show(self.visible == True)
+
+    def clearHeadDisk(self):
+        if self.head_disk_drawable != None:
+            self.head_disk_drawable.show(False)
+            self.head_disk_drawable = None
+
+    def clearDisks(self):
+        self.clearHeadDisk()
+        if self.tail_disk_drawable != None:
+            self.tail_disk_drawable.show(False)
+            self.tail_disk_drawable = None
+
+    def show(self, visible, show_text):
+        """ Display or hide drawables, only touching them when the visibility 
+            actually changes.
+        """
+        if show_text != self.text_visible:
+            self.text_visible = show_text
+            self.text_drawable.show(show_text)
+        if visible == self.visible: return
+        self.visible = visible
+        self.tail_spot_drawable.show(visible)
+        self.head_spot_drawable.show(visible)
+        self.line_drawable.show(visible)
+        if self.tail_disk_drawable != None:
+            self.tail_disk_drawable.show(visible)
+        if self.head_disk_drawable != None:
+            self.head_disk_drawable.show(visible)
+
+    def draw(self, handle, detail):
+        if detail == Detail.point:
+            hou.GeometryDrawable.draw(self.head_spot_drawable, handle, self.spot_params)
+            return
+        if detail == Detail.full:
+            if self.tail_disk_drawable != None:
+                hou.GeometryDrawable.draw(self.tail_disk_drawable, handle)
+            if self.head_disk_drawable != None:
+                hou.GeometryDrawable.draw(self.head_disk_drawable, handle)
+        hou.GeometryDrawable.draw(self.line_drawable, handle, self.line_params)
+        hou.GeometryDrawable.draw(self.tail_spot_drawable, handle, self.spot_params)
+        hou.GeometryDrawable.draw(self.head_spot_drawable, handle, self.spot_params)
+        if detail == Detail.full:
+            hou.TextDrawable.draw(self.text_drawable, handle, self.text_params)
+
+class Measurement(object):
+    """ Data of one measurement. Drawables are only attached while the 
+        measurement is being drawn out, see MeasurementDrawables.
+    """
+    __slots__ = ('tail_pos', 'head_pos', 'measurement', 'curPlane', 'color', 'name', 'text', 
+            'angle_snapping', 'snapped_angle', 'show_text', 'committed', 'drawables', 'tail_anchor', 'head_anchor')
+    default_font_size = 18.0
+    default_text = "default text"
+
+    def __init__(self, color, show_text, drawables=None):
+        self.color = color
         self.tail_pos = hou.Vector3(0.0, 0.0, 0.0)
         self.head_pos = hou.Vector3(0.0, 0.0, 0.0)
-        self.spot_size = 0.01
         self.measurement = 0.0
-        self.font_size = Measurement.default_font_size
-        self.font_color = color.getHexStr()
         self.text = Measurement.default_text
         self.curPlane = None
         self.angle_snapping = False
+        self.snapped_angle = None
         self.name = ""
         self.show_text = show_text
+        self.committed = False
+        self.drawables = None
+        self.tail_anchor = None #(points, weights) on the geometry, see MeasureEngine.intersectAnchored
+        self.head_anchor = None
+        if drawables != None:
+            self.attach(drawables)
+
+    def attach(self, drawables):
+        self.drawables = drawables
+        drawables.bind(self.color)
         self.updateTextField()
 
+    def detach(self):
+        if self.drawables == None: return
+        self.show(False)
+        self.drawables.clearDisks()
+        self.drawables = None
+
     def getLength(self):
         return self.measurement
 
-    def setTextScale(self, scale):
-        self.text_params['scale'] = hou.Vector3(scale, scale, scale)
-
     def getTailPos(self):
         return self.tail_pos
 
@@ -247,85 +529,77 @@ class Measurement(object):
         return hou.Vector3.normalized(self.head_pos - self.tail_pos)
 
     def show(self, visible):
-        """ Display or hide drawables.
+        """ Display or hide drawables. Committed measurements are drawn by 
+            the container, so they stay hidden.
         """
-        self.text_drawable.show(self.show_text)
-        self.tail_spot_drawable.show(visible)
-        self.head_spot_drawable.show(visible)
-        self.line_drawable.show(visible)
-        if self.tail_disk_drawable != None:
-            self.tail_disk_drawable.show(visible)
-        if self.head_disk_drawable != None:
-            self.head_disk_drawable.show(visible)
+        if self.drawables == None: return
+        self.drawables.show(visible and not self.committed, self.show_text and not self.committed)
 
     def setText(self, measurement):
-        self.text = str(round(measurement, 5))
-        self.updateTextField()
-
-    def setFontSize(self, size):
-        self.font_size = size
-        self.updateTextField()
-
-    def setFontColor(self, color):
-        self.font_color = color
+        self.text = round(measurement, 5)
         self.updateTextField()
 
     def setTextPos(self, x, y):
-        self.text_params['translate'][0] = x
-        self.text_params['translate'][1] = y
+        translate = self.drawables.text_params['translate']
+        translate[0] = x
+        translate[1] = y
+
+    @staticmethod
+    def formatText(text, font_size, font_color):
+        return '<font size={1} color="{2}"><b> {0} </b></font>'.format(text, font_size, font_color)
 
     def updateTextField(self):
-        font_string = '<font size={1} color="{2}"><b> {0} </b></font>'.format(self.text, self.font_size, self.font_color)
-        self.text_params['text'] = font_string
+        if self.drawables == None: return
+        self.drawables.setText(label_cache.get(self.text, Measurement.default_font_size, self.color))
 
-    def draw( self, handle ):
-        """ This callback is used for rendering the drawables
+    def draw( self, handle, detail=None ):
+        """ This callback is used for rendering the drawables. detail is one 
+            of the Detail levels picked by the container's visibility pass.
         """
-        if self.tail_disk_drawable != None:
-            hou.GeometryDrawable.draw(self.tail_disk_drawable, handle)
-        if self.head_disk_drawable != None:
-            hou.GeometryDrawable.draw(self.head_disk_drawable, handle)
-        hou.GeometryDrawable.draw(self.line_drawable, handle, self.line_params)
-        hou.GeometryDrawable.draw(self.tail_spot_drawable, handle, self.spot_params)
-        hou.GeometryDrawable.draw(self.head_spot_drawable, handle, self.spot_params)
-        hou.TextDrawable.draw(self.text_drawable, handle, self.text_params)
+        if detail == None:
+            detail = Detail.full
+        if detail == Detail.hidden or self.drawables == None:
+            return
+        self.drawables.draw(handle, detail)
 
-    def drawInterrupt(self, handle, geometry_viewport):
+    def updateTextPos(self, geometry_viewport):
         screen_pos = hou.GeometryViewport.mapToScreen(geometry_viewport, self.head_pos)
         self.setTextPos(screen_pos[0], screen_pos[1])
-        if self.tail_disk_drawable != None:
-            hou.GeometryDrawable.draw(self.tail_disk_drawable, handle)
-        if self.head_disk_drawable != None:
-            hou.GeometryDrawable.draw(self.head_disk_drawable, handle)
-        hou.GeometryDrawable.draw(self.line_drawable, handle, self.line_params)
-        hou.GeometryDrawable.draw(self.tail_spot_drawable, handle, self.spot_params)
-        hou.GeometryDrawable.draw(self.head_spot_drawable, handle, self.spot_params)
-        hou.TextDrawable.draw(self.text_drawable, handle, self.text_params)
+
+    def drawInterrupt(self, handle, geometry_viewport, detail=None):
+        self.updateTextPos(geometry_viewport)
+        self.draw(handle, detail)
 
     def setPlane(self, plane):
         self.curPlane = plane
 
+    def commit(self):
+        """ Hand the measurement over to the store, releasing the drawables. 
+        """
+        self.committed = True
+        self.detach()
+
     def angleSnapping(self, yes):
         if (yes):
             self.angle_snapping = True
         else:
             self.angle_snapping = False
 
-    def setSpotTransform(self, drawable, model_to_camera, camera_to_ndc):
+    def setSpotTransform(self, drawable, view):
         initToCurDir = (self.head_pos - self.tail_pos).normalized()
-        if (drawable == self.tail_spot_drawable):
+        if (drawable == self.drawables.tail_spot_drawable):
             initToCurDir *= -1
             translate = hou.hmath.buildTranslate(self.tail_pos)
         else:
             translate = hou.hmath.buildTranslate(self.head_pos)
         rotate = hou.hmath.buildRotateZToAxis(initToCurDir)
-        scale = getCameraCancellingScale(translate, model_to_camera, camera_to_ndc, self.spot_size)
+        scale = getCameraCancellingScale(translate, view, MeasurementDrawables.spot_size)
         transform = rotate * scale * translate
         hou.GeometryDrawable.setTransform(drawable, transform)
 
-    def setDiskTransform(self, disk, pos, model_to_camera, camera_to_ndc):
+    def setDiskTransform(self, disk, pos, view):
         translate = hou.hmath.buildTranslate(pos)
-        scale = getCameraCancellingScale(translate, model_to_camera, camera_to_ndc, self.spot_size)
+        scale = getCameraCancellingScale(translate, view, MeasurementDrawables.spot_size)
         transform = scale * translate
         hou.GeometryDrawable.setTransform(disk, transform)
 
@@ -340,21 +614,11 @@ class Measurement(object):
     def setTailPos(self, pos):
         self.tail_pos = pos
 
-    def setTailDisk(self, plane, scene_viewer,  model_to_camera, camera_to_ndc):
-        if plane == Plane.X: self.tail_disk_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "circle", self.disk_x)
-        if plane == Plane.Y: self.tail_disk_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "circle", self.disk_y)
-        if plane == Plane.Z: self.tail_disk_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "circle", self.disk_z)
-        self.setDiskTransform(self.tail_disk_drawable, self.tail_pos, model_to_camera, camera_to_ndc)
-
-    def setHeadDisk(self, plane, scene_viewer):
-        if plane == Plane.X: 
-            self.head_disk_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "circle", self.disk_x)
-        elif plane == Plane.Y: 
-            self.head_disk_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "circle", self.disk_y)
-        elif plane == Plane.Z: 
-            self.head_disk_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "circle", self.disk_z)
-        else:
+    def setTailDisk(self, plane, view):
+        if plane not in (Plane.X, Plane.Y, Plane.Z):
             return
+        self.drawables.setTailDisk(plane)
+        self.setDiskTransform(self.drawables.tail_disk_drawable, self.tail_pos, view)
 
     def updateHeadPos(self, pos):
         self.head_pos = pos 
@@ -364,133 +628,1783 @@ class Measurement(object):
         self.setTextPos(screen_pos[0], screen_pos[1])
         self.setText(self.measurement)
 
-    def updateDrawables(self, model_to_camera, camera_to_ndc, plane, scene_viewer):
-        self.setSpotTransform(self.tail_spot_drawable, model_to_camera, camera_to_ndc)
-        self.setSpotTransform(self.head_spot_drawable, model_to_camera, camera_to_ndc)
-        self.setLineTransform(self.line_drawable)
+    def updateDrawables(self, view, plane):
+        drawables = self.drawables
+        self.setSpotTransform(drawables.tail_spot_drawable, view)
+        self.setSpotTransform(drawables.head_spot_drawable, view)
+        self.setLineTransform(drawables.line_drawable)
         if (plane == None):
-            self.head_disk_drawable = None
+            drawables.clearHeadDisk()
             return
-        self.setHeadDisk(plane, scene_viewer)
-        self.setDiskTransform(self.head_disk_drawable, self.head_pos, model_to_camera, camera_to_ndc)
+        drawables.setHeadDisk(plane)
+        self.setDiskTransform(drawables.head_disk_drawable, self.head_pos, view)
 
-    def update(self, intersection, screen_pos, model_to_camera, camera_to_ndc, scene_viewer):
+    def update(self, intersection, screen_pos, view):
         self.updateHeadPos(intersection.pos)
         self.updateText(screen_pos)
         if (intersection.plane != None):
-            self.updateDrawables(model_to_camera, camera_to_ndc, self.curPlane, scene_viewer)
+            self.updateDrawables(view, self.curPlane)
         else:
-            self.updateDrawables(model_to_camera, camera_to_ndc, None, scene_viewer)
+            self.updateDrawables(view, None)
+
+class MeasurementStore(object):
+    """ Committed measurements as one structured numpy array, a record per 
+        measurement holding its tail, head, plane (-1 for none), color index, 
+        snapped angle (NaN if it was not angle snapped), name and the anchors 
+        of its ends: three point numbers (-1 if not anchored) and their 
+        weights. Records are appended and popped at the end like the 
+        measurements themselves, and the used part of the array serializes to 
+        bytes as is, so saving and restoring is a single copy.
+    """
+    record = [('tail', '<f8', (3,)), ('head', '<f8', (3,)), ('plane', 'i1'), ('color', 'i1'), ('angle', '<f4'), ('name', 'S32'), 
+            ('tail_points', '<i4', (3,)), ('tail_weights', '<f8', (3,)), ('head_points', '<i4', (3,)), ('head_weights', '<f8', (3,))]
+    magic = b"RULER3"
+    legacy_records = {
+            b"RULER1": [('tail', '<f8', (3,)), ('head', '<f8', (3,)), ('plane', 'i1'), ('color', 'i1'), ('name', 'S32')],
+            b"RULER2": [('tail', '<f8', (3,)), ('head', '<f8', (3,)), ('plane', 'i1'), ('color', 'i1'), ('angle', '<f4'), ('name', 'S32')],
+            }
+    user_data_key = "ruler_measurements"
+
+    def __init__(self, records=None):
+        self.records = np.zeros(16, dtype=MeasurementStore.record)
+        self.count = 0
+        self.version = 0 #bumped whenever a record is added, removed or moved
+        if records is not None:
+            self.reserve(len(records))
+            self.records[:len(records)] = records
+            self.count = len(records)
+
+    @staticmethod
+    def fromArrays(tails, heads, planes=None, angles=None, colors=None):
+        """ Store holding one record per row of the (n, 3) tails and heads. 
+            planes, angles and colors default to none, not snapped and the 
+            first color.
+        """
+        tails = np.asarray(tails, dtype=np.float64).reshape(-1, 3)
+        records = np.zeros(len(tails), dtype=MeasurementStore.record)
+        records['tail'] = tails
+        records['head'] = np.asarray(heads, dtype=np.float64).reshape(-1, 3)
+        records['plane'] = -1 if planes is None else planes
+        records['angle'] = np.nan if angles is None else angles
+        records['color'] = 0 if colors is None else colors
+        records['tail_points'] = -1
+        records['head_points'] = -1
+        return MeasurementStore(records)
+
+    def reserve(self, size):
+        if size <= len(self.records): return
+        grown = np.zeros(max(size, 2 * len(self.records)), dtype=MeasurementStore.record)
+        grown[:self.count] = self.records[:self.count]
+        self.records = grown
+
+    def append(self, tail, head, plane, color, angle=None, name="", tail_anchor=None, head_anchor=None):
+        self.reserve(self.count + 1)
+        plane = -1 if plane == None else plane
+        angle = np.nan if angle == None else angle
+        unanchored = ((-1, -1, -1), (0.0, 0.0, 0.0))
+        tail_points, tail_weights = unanchored if tail_anchor == None else tail_anchor
+        head_points, head_weights = unanchored if head_anchor == None else head_anchor
+        self.records[self.count] = (tuple(tail), tuple(head), plane, color, angle, name.encode('utf-8'), 
+                tuple(tail_points), tuple(tail_weights), tuple(head_points), tuple(head_weights))
+        self.count += 1
+        self.version += 1
+
+    def pop(self):
+        if self.count < 1: return
+        self.count -= 1
+        self.version += 1
+
+    def valid(self):
+        return self.records[:self.count]
+
+    def tails(self):
+        return self.records['tail'][:self.count]
+
+    def heads(self):
+        return self.records['head'][:self.count]
+
+    def colors(self):
+        return self.records['color'][:self.count]
+
+    def endpoints(self):
+        """ Tail and head positions of every record as a (2 * count, 3) array. 
+        """
+        positions = np.empty((self.count * 2, 3))
+        positions[0::2] = self.tails()
+        positions[1::2] = self.heads()
+        return positions
+
+    def lengths(self):
+        return np.sqrt(((self.heads() - self.tails()) ** 2).sum(axis=1))
+
+    def reanchor(self, positions):
+        """ Move every anchored tail and head onto positions, the (n, 3) point 
+            positions of the current frame, with one gather and weighted sum 
+            for all of them. Anchors on point numbers the geometry no longer 
+            has are dropped and their ends stay where they are. Returns 
+            whether anything moved.
+        """
+        if self.count < 1:
+            return False
+        points = np.concatenate((self.records['tail_points'][:self.count], self.records['head_points'][:self.count]))
+        lost = (points >= len(positions)).any(axis=1)
+        if lost.any():
+            points[lost] = -1
+            self.records['tail_points'][:self.count] = points[:self.count]
+            self.records['head_points'][:self.count] = points[self.count:]
+        rows = np.flatnonzero(points[:, 0] >= 0)
+        if len(rows) == 0:
+            return False
+        weights = np.concatenate((self.records['tail_weights'][:self.count], self.records['head_weights'][:self.count]))
+        ends = np.concatenate((self.tails(), self.heads()))
+        ends[rows] = MeasureEngine.evaluateAnchors(positions, points[rows], weights[rows])
+        self.records['tail'][:self.count] = ends[:self.count]
+        self.records['head'][:self.count] = ends[self.count:]
+        self.version += 1
+        return True
+
+    def length(self, index):
+        record = self.records[index % self.count]
+        return float(np.sqrt(((record['head'] - record['tail']) ** 2).sum()))
+
+    def toBytes(self):
+        return MeasurementStore.magic + self.valid().tobytes()
+
+    @staticmethod
+    def fromBytes(data):
+        """ Inverse of toBytes, also reading data written with older record 
+            layouts. Raises ValueError if data was not written by it. 
+        """
+        magic = data[:len(MeasurementStore.magic)]
+        if magic == MeasurementStore.magic:
+            return MeasurementStore(np.frombuffer(data[len(magic):], dtype=MeasurementStore.record))
+        if magic not in MeasurementStore.legacy_records:
+            raise ValueError("Not ruler measurement data")
+        old = np.frombuffer(data[len(magic):], dtype=MeasurementStore.legacy_records[magic])
+        records = np.zeros(len(old), dtype=MeasurementStore.record)
+        records['angle'] = np.nan
+        records['tail_points'] = -1
+        records['head_points'] = -1
+        for name in old.dtype.names:
+            records[name] = old[name]
+        return MeasurementStore(records)
+
+    def table(self):
+        """ One row per measurement with the export_columns as float64. 
+        """
+        tails, heads = self.tails(), self.heads()
+        table = np.empty((self.count, len(export_columns)))
+        table[:, 0:3] = tails
+        table[:, 3:6] = heads
+        table[:, 6:9] = heads - tails
+        table[:, 9] = self.lengths()
+        table[:, 10] = self.records['plane'][:self.count]
+        table[:, 11] = self.records['angle'][:self.count]
+        return table
+
+    def save(self, node):
+        """ Store the records in node's user data, removing the entry when 
+            there is nothing to keep.
+        """
+        if self.count < 1:
+            hou.Node.destroyUserData(node, MeasurementStore.user_data_key, False)
+            return
+        encoded = base64.b64encode(self.toBytes()).decode('ascii')
+        hou.Node.setUserData(node, MeasurementStore.user_data_key, encoded)
 
-class MeasurementContainer(object):
-    colors = (
-            Color(Color.green), Color(Color.yellow),
-            Color(Color.pink), Color(Color.purple))
+    @staticmethod
+    def load(node):
+        """ Store read back from node's user data, or None if it has none. 
+        """
+        encoded = hou.Node.userData(node, MeasurementStore.user_data_key)
+        if encoded == None:
+            return None
+        return MeasurementStore.fromBytes(base64.b64decode(encoded))
+
+    def saveFile(self, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(path, 'wb') as f:
+            f.write(self.toBytes())
+
+    @staticmethod
+    def loadFile(path):
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return MeasurementStore.fromBytes(f.read())
+
+    @staticmethod
+    def sidecarPath(node):
+        """ File used when the node cannot hold user data, e.g. inside a 
+            locked asset.
+        """
+        name = node.path().strip("/").replace("/", "_") + ".ruler"
+        return os.path.join(hou.expandString("$HIP"), "ruler", name)
+
+export_columns = ('tail_x', 'tail_y', 'tail_z', 'head_x', 'head_y', 'head_z', 
+        'delta_x', 'delta_y', 'delta_z', 'length', 'plane', 'angle')
+
+def writeCSV(table, path, chunk_size=4096):
+    """ Write table with a header row. Rows are formatted a chunk at a time 
+        with a single % operation instead of one string per row.
+    """
+    row = ",".join(("%.12g",) * 10 + ("%d", "%.12g")) + "\n"
+    with open(path, 'w') as f:
+        f.write(",".join(export_columns) + "\n")
+        for start in range(0, len(table), chunk_size):
+            chunk = table[start:start + chunk_size]
+            f.write((row * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+def writeJSON(table, path):
+    """ Write table as an object of columns. Angles that were not snapped 
+        become null.
+    """
+    with open(path, 'w') as f:
+        f.write("{")
+        for i, name in enumerate(export_columns):
+            column = table[:, i]
+            if name == 'plane':
+                values = column.astype(int).tolist()
+            else:
+                values = np.where(np.isnan(column), None, column).tolist()
+            f.write('%s"%s": %s' % (", " if i else "", name, json.dumps(values)))
+        f.write("}\n")
+
+def writeNumpy(table, path):
+    """ Write table as a structured array with one field per column. 
+        Stores the array with np.save.
+    """
+    records = np.zeros(len(table), dtype=[(name, '<f8') for name in export_columns])
+    for i, name in enumerate(export_columns):
+        records[name] = table[:, i]
+    np.save(path, records)
+
+export_writers = {'.csv': writeCSV, '.json': writeJSON, '.npy': writeNumpy}
+
+def exportMeasurements(store, path):
+    """ Write every measurement in store to path, picking the format from 
+        its extension. Raises ValueError for unknown extensions.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in export_writers:
+        raise ValueError("Unknown export format '{}', use one of {}".format(extension, ", ".join(sorted(export_writers))))
+    export_writers[extension](store.table(), path)
+
+class MeasurementBatch(object):
+    """ Merged geometry holding every committed measurement. Each measurement 
+        adds a tail and head point carrying its Cd and one open line primitive 
+        between them, so all committed measurements draw with one line call 
+        and one point call no matter how many there are.
+    """
+    def __init__(self, scene_viewer):
+        self.geo = MeasurementBatch.emptyGeometry()
+        self.count = 0
+        self.version = 0 #bumped whenever a segment is added or removed
+        self.line_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "batch_lines", self.geo)
+        self.point_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Point, "batch_points", self.geo)
+        self.line_params = {'line_width': 4.0, 'style': (10.0, 5.0), 'fade_factor':0.3, 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':5}
+        self.point_params = {'style': hou.drawableGeometryPointStyle.SmoothCircle, 'radius': 3, 'fade_factor': 0.5, 
+                'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':5}
+
+    @staticmethod
+    def emptyGeometry():
+        geo = hou.Geometry()
+        hou.Geometry.addAttrib(geo, hou.attribType.Point, "Cd", (1.0, 1.0, 1.0))
+        return geo
+
+    def show(self, visible):
+        self.line_drawable.show(visible)
+        self.point_drawable.show(visible)
+
+    def refresh(self):
+        self.version += 1
+        self.line_drawable.setGeometry(self.geo)
+        self.point_drawable.setGeometry(self.geo)
+
+    def append(self, tail, head, color):
+        """ Add one segment to the merged geometry. 
+        """
+        start = self.count * 2
+        points = hou.Geometry.createPoints(self.geo, (tuple(tail), tuple(head)))
+        for point in points:
+            hou.Point.setAttribValue(point, "Cd", tuple(color))
+        hou.Geometry.createPolygons(self.geo, ((start, start + 1),), False)
+        self.count += 1
+        self.refresh()
+
+    def rebuild(self, positions, colors):
+        """ Replace every segment at once. positions is a (2n, 3) array of 
+            tails and heads, colors an (n, 3) array. 
+        """
+        geo = MeasurementBatch.emptyGeometry()
+        count = len(colors)
+        if count > 0:
+            hou.Geometry.createPoints(geo, positions.tolist())
+            hou.Geometry.setPointFloatAttribValues(geo, "Cd", np.repeat(colors, 2, axis=0).ravel().tolist())
+            pairs = np.arange(count * 2).reshape(-1, 2)
+            hou.Geometry.createPolygons(geo, pairs.tolist(), False)
+        self.geo = geo
+        self.count = count
+        self.refresh()
+
+    def move(self, positions):
+        """ Set the point positions of every segment, a (2n, 3) array of tails 
+            and heads, keeping the geometry's topology.
+        """
+        if self.count < 1: return
+        hou.Geometry.setPointFloatAttribValues(self.geo, "P", positions.ravel().tolist())
+        self.refresh()
+
+    def pop(self):
+        """ Remove the most recently appended segment along with its points.
+        """
+        if self.count < 1: return
+        self.count -= 1
+        hou.Geometry.deletePrims(self.geo, (hou.Geometry.prim(self.geo, self.count),))
+        self.refresh()
 
-    def __init__(self, viewport, text_size):
-        self.measurements = []
+    def draw(self, handle):
+        if self.count < 1: return
+        hou.GeometryDrawable.draw(self.line_drawable, handle, self.line_params)
+        hou.GeometryDrawable.draw(self.point_drawable, handle, self.point_params)
+
+class Detail:
+    hidden, point, line, full = range(0, 4)
+
+class MeasurementContainer(object):
+    """ The measurement being drawn out is a full Measurement with its own 
+        drawables. Committed ones only live in the MeasurementStore; they are 
+        rendered by the MeasurementBatch and one shared label drawable.
+    """
+    cull_margin = 50.0 #pixels outside the viewport that still count as on screen
+    colors = None #created on first use
+
+    @staticmethod
+    def getColors():
+        if MeasurementContainer.colors == None:
+            MeasurementContainer.colors = (
+                    Color(Color.green), Color(Color.yellow),
+                    Color(Color.pink), Color(Color.purple))
+        return MeasurementContainer.colors
+
+    def __init__(self, scene_viewer, viewport, text_size, lod_length):
+        self.scene_viewer = scene_viewer
+        self.store = MeasurementStore()
+        self.active = None
+        self.drawables = None #created with the first measurement
+        self.active_color = 0
+        self.batch = MeasurementBatch(scene_viewer)
+        self.label_drawable = hou.TextDrawable(scene_viewer, "committed_labels")
+        self.label_params = {'text': None, 'translate': hou.Vector3(0.0, 0.0, 0.0), 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':10, 'color2':hou.Vector4(0,0,0,0.5), 'scale':hou.Vector3(text_size, text_size, text_size)}
         self.viewport = viewport
         self.show_text = True
         self.text_scale = text_size
+        self.lod_length = lod_length
+        self.visibility_key = None
+        self.labels = ()
+        self.texts = {}
+        self.texts_version = None
+        self.visible = False
 
     def showAll(self):
-        for m in self.measurements: 
-            m.show(True)
+        self.visible = True
+        self.batch.show(True)
+        self.label_drawable.show(self.show_text)
+        if self.active != None:
+            self.active.show(True)
+
+    def showActive(self):
+        """ Make sure the measurement being drawn out is visible. Only touches 
+            that measurement once the container is shown, so it is cheap to 
+            call on every drag update.
+        """
+        if not self.visible:
+            self.showAll()
+        elif self.active != None:
+            self.active.show(True)
 
     def showText(self, val):
         self.show_text = val
-        for m in self.measurements:
-            m.show_text = val
-            m.show(True)
+        self.label_drawable.show(val and self.visible)
+        if self.active != None:
+            self.active.show_text = val
+            self.active.show(self.visible)
 
     def setScale(self, scale):
         self.text_scale = scale
-        for m in self.measurements:
-            m.setTextScale(scale)
+        self.label_params['scale'] = hou.Vector3(scale, scale, scale)
+        if self.drawables != None:
+            self.drawables.text_params['scale'] = hou.Vector3(scale, scale, scale)
 
     def hideAll(self):
-        for m in self.measurements: 
-            m.show(False)
+        self.visible = False
+        self.batch.show(False)
+        self.label_drawable.show(False)
+        if self.active != None:
+            self.active.show(False)
 
     def removeAll(self):
         while (self.count() > 0):
             self.removeMeasurement()
 
     def count(self):
-        return len(self.measurements)
+        return self.store.count + (0 if self.active == None else 1)
 
     def addMeasurement(self, scene_viewer):
-        colorIndex = self.count() % len(MeasurementContainer.colors)
-        self.measurements.append(Measurement(scene_viewer, MeasurementContainer.colors[colorIndex], self.show_text, self.text_scale))
-        self.measurements[-1].show(False)
+        self.active_color = self.count() % len(MeasurementContainer.getColors())
+        if self.drawables == None:
+            self.drawables = MeasurementDrawables(scene_viewer, self.text_scale)
+        self.active = Measurement(MeasurementContainer.getColors()[self.active_color], self.show_text, self.drawables)
+        self.active.show(False)
+
+    def committedCount(self):
+        return self.store.count
+
+    def palette(self):
+        return np.array([tuple(c.getVec3()) for c in MeasurementContainer.getColors()])
+
+    def commit(self):
+        """ Move the current measurement into the store and the merged batch 
+            once it is finished. Only the measurement being drawn out is 
+            rendered on its own.
+        """
+        if self.active == None: return
+        m = self.active
+        m.commit()
+        self.store.append(m.getTailPos(), m.getHeadPos(), m.curPlane, self.active_color, m.snapped_angle, m.name, 
+                m.tail_anchor, m.head_anchor)
+        self.batch.append(m.getTailPos(), m.getHeadPos(), m.getColor())
+        self.active = None
+
+    def restore(self, store):
+        """ Replace the committed measurements with store, rebuilding the batch 
+            geometry in one go.
+        """
+        if self.active != None:
+            self.active.detach()
+            self.active = None
+        self.store = store
+        self.batch.rebuild(store.endpoints(), self.palette()[store.colors()])
+        self.visibility_key = None
+
+    def reanchor(self, positions):
+        """ Move the anchored measurements onto the point positions of the 
+            current frame, see MeasurementStore.reanchor.
+        """
+        if self.store.reanchor(positions):
+            self.batch.move(self.store.endpoints())
 
     def removeMeasurement(self):
-        if self.count() < 1: return
-        self.current().show(False)
-        self.measurements.pop()
+        if self.active != None:
+            self.active.detach()
+            self.active = None
+        elif self.store.count > 0:
+            self.store.pop()
+            self.batch.pop()
+        else:
+            return
         hou.GeometryViewport.draw(self.viewport)
 
-    def draw(self, handle):
-        for m in self.measurements:
-            m.draw(handle)
+    def lastLength(self):
+        """ Length of the most recent measurement, finished or not. 
+        """
+        if self.active != None:
+            return self.active.getLength()
+        return self.store.length(-1)
+
+    def setLodLength(self, length):
+        self.lod_length = length
+        self.visibility_key = None
 
-    def drawInterrupt(self, handle, geometry_viewport):
-        for m in self.measurements:
-            m.drawInterrupt(handle, geometry_viewport)
+    def classify(self, view, positions):
+        """ Pick a Detail level for each tail/head pair in positions, an 
+            (2n, 3) array, from their projected screen length. 
+        """
+        screen, in_front = view.toScreen(positions)
+        tails, heads = screen[0::2], screen[1::2]
+        front = in_front[0::2] & in_front[1::2]
+        behind = ~(in_front[0::2] | in_front[1::2])
+        lo = np.minimum(tails, heads)
+        hi = np.maximum(tails, heads)
+        margin = MeasurementContainer.cull_margin
+        width, height = view.size
+        onscreen = ((hi[:, 0] >= -margin) & (lo[:, 0] <= width + margin) & 
+                (hi[:, 1] >= -margin) & (lo[:, 1] <= height + margin))
+        length = np.hypot(heads[:, 0] - tails[:, 0], heads[:, 1] - tails[:, 1])
+
+        detail = np.full(len(tails), Detail.full, dtype=int)
+        detail[length < self.lod_length] = Detail.line
+        detail[length < 1.0] = Detail.point
+        detail[~front] = Detail.line #one end behind the camera, the length means nothing
+        detail[~onscreen & front] = Detail.hidden
+        detail[behind] = Detail.hidden
+        return detail, heads
+
+    def updateVisibility(self, view):
+        """ Project every committed measurement in one pass and keep the text 
+            and screen position of the ones whose label should be drawn. Only 
+            redone when the camera, the store or the threshold changed.
+        """
+        key = (view.version, self.store.version, self.lod_length)
+        if key == self.visibility_key: return
+        self.visibility_key = key
+        if self.store.count < 1:
+            self.labels = ()
+            return
+        detail, heads = self.classify(view, self.store.endpoints())
+        shown = np.flatnonzero(detail == Detail.full)
+        if self.texts_version != self.store.version:
+            self.texts_version = self.store.version
+            self.texts = {} #record index -> label text, valid while the store is unchanged
+        missing = [i for i in shown.tolist() if i not in self.texts]
+        if missing:
+            lengths = self.store.lengths()[missing]
+            colors = self.store.colors()[missing]
+            palette = MeasurementContainer.getColors()
+            for i, length, color in zip(missing, lengths.tolist(), colors.tolist()):
+                self.texts[i] = label_cache.get(round(length, 5), Measurement.default_font_size, palette[color])
+        self.labels = [(self.texts[i], heads[i, 0], heads[i, 1]) for i in shown.tolist()]
+
+    def activeDetail(self, view, m):
+        positions = np.array((tuple(m.getTailPos()), tuple(m.getHeadPos())))
+        return self.classify(view, positions)[0][0]
+
+    def drawLabels(self, handle):
+        params = self.label_params
+        translate = params['translate']
+        for text, x, y in self.labels:
+            params['text'] = text
+            translate[0] = x
+            translate[1] = y
+            hou.TextDrawable.draw(self.label_drawable, handle, params)
+
+    def draw(self, handle, view):
+        self.batch.draw(handle)
+        self.updateVisibility(view)
+        if self.show_text:
+            self.drawLabels(handle)
+        if self.active != None:
+            self.active.draw(handle, self.activeDetail(view, self.active))
+
+    def drawInterrupt(self, handle, geometry_viewport, view):
+        self.draw(handle, view)
 
     def current(self):
-        if self.count() < 1: 
+        if self.active == None: 
             raise hou.Error("No measurements available!") #this check is for debugging. we should never be in this place if things work correctly.
-        return self.measurements[-1]
+        return self.active
+
+class ShapeTotals(object):
+    """ Running totals of the vertices picked for a polyline, area or angle. 
+        Each vertex adds one entry to prefix sums of the polyline length and 
+        of the cross products making up the vector area of the polygon fanned 
+        from the first vertex, so adding, removing or previewing a vertex is 
+        O(1) however long the chain gets.
+    """
+    def __init__(self):
+        self.vertices = []
+        self.lengths = [] #polyline length up to each vertex
+        self.crosses = [] #twice the vector area fanned from the first vertex up to each vertex
+
+    def count(self):
+        return len(self.vertices)
+
+    def fanCross(self, a, b):
+        first = self.vertices[0]
+        return (a - first).cross(b - first)
+
+    def add(self, pos):
+        pos = hou.Vector3(pos)
+        if len(self.vertices) < 1:
+            self.lengths.append(0.0)
+            self.crosses.append(hou.Vector3(0.0, 0.0, 0.0))
+        else:
+            self.lengths.append(self.lengths[-1] + (pos - self.vertices[-1]).length())
+            self.crosses.append(self.crosses[-1] + self.fanCross(self.vertices[-1], pos))
+        self.vertices.append(pos)
+
+    def pop(self):
+        if len(self.vertices) < 1: return
+        self.vertices.pop()
+        self.lengths.pop()
+        self.crosses.pop()
+
+    def length(self, cursor=None):
+        """ Polyline length, continued to cursor if given. 
+        """
+        if len(self.vertices) < 1:
+            return 0.0
+        if cursor is None:
+            return self.lengths[-1]
+        return self.lengths[-1] + (hou.Vector3(cursor) - self.vertices[-1]).length()
+
+    def perimeter(self, cursor=None):
+        if len(self.vertices) < 1:
+            return 0.0
+        end = self.vertices[-1] if cursor is None else hou.Vector3(cursor)
+        return self.length(cursor) + (end - self.vertices[0]).length()
+
+    def area(self, cursor=None):
+        """ Area of the polygon closed from the last vertex, or from cursor if 
+            given, back to the first. 
+        """
+        if len(self.vertices) < 1:
+            return 0.0
+        cross = self.crosses[-1]
+        if cursor is not None:
+            cross = cross + self.fanCross(self.vertices[-1], hou.Vector3(cursor))
+        return 0.5 * cross.length()
+
+    def angle(self, cursor=None):
+        """ Angle in degrees at the second vertex between the first and the 
+            third, with cursor standing in for a missing third.
+        """
+        corners = self.vertices[:3]
+        if cursor is not None and len(corners) < 3:
+            corners = corners + [hou.Vector3(cursor)]
+        if len(corners) < 3:
+            return 0.0
+        return (corners[0] - corners[1]).angleTo(corners[2] - corners[1])
+
+    def total(self, shape, cursor=None):
+        if shape == Shape.area:
+            return self.area(cursor)
+        if shape == Shape.angle:
+            return self.angle(cursor)
+        return self.length(cursor)
+
+class ShapeDrawing(object):
+    """ Drawables of the polyline, area or angle being picked. Its vertices 
+        are one open polygon in a single geometry that grows by a point and a 
+        vertex per pick, so a shape of dozens of segments is still one line 
+        and one point draw. The rubber band from the last vertex through the 
+        cursor, and back to the first vertex for areas, is a separate three 
+        point polyline whose positions are set in place.
+    """
+    def __init__(self, scene_viewer, text_scale):
+        color = Color(Color.purple)
+        self.geo = hou.Geometry()
+        self.poly = None
+        self.count = 0
+        self.band = hou.Geometry()
+        hou.Geometry.createPoints(self.band, ((0.0, 0.0, 0.0),) * 3)
+        hou.Geometry.createPolygons(self.band, ((0, 1, 2),), False)
+        self.line_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "shape_lines", self.geo)
+        self.point_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Point, "shape_points", self.geo)
+        self.band_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Line, "shape_band", self.band)
+        self.text_drawable = hou.TextDrawable(scene_viewer, "shape_text")
+        self.text = None #last text pushed to text_drawable
+        self.anchor = None #world position of the text
+        self.placed = None #(view version, anchor) the text was last projected for
+        self.in_front = False
+        self.hex_str = color.getHexStr()
+        self.line_params = {'line_width': 4.0, 'color1': color.getVec(), 'fade_factor':0.3, 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':5}
+        self.band_params = {'line_width': 2.0, 'style': (10.0, 5.0), 'color1': color.getVec(), 'fade_factor':0.3}
+        self.point_params = {'style': hou.drawableGeometryPointStyle.SmoothCircle, 'radius': 3, 'color1': color.getVec(), 'fade_factor': 0.5}
+        self.text_params = {'translate': hou.Vector3(0.0, 0.0, 0.0), 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':10, 'color2':hou.Vector4(0,0,0,0.5), 'scale':hou.Vector3(text_scale, text_scale, text_scale)}
+        self.visible = False
+        self.band_visible = False
+
+    def refresh(self):
+        self.line_drawable.setGeometry(self.geo)
+        self.point_drawable.setGeometry(self.geo)
+
+    def add(self, pos):
+        """ Append a vertex, adding one point and one polygon vertex. 
+        """
+        point = hou.Geometry.createPoint(self.geo)
+        hou.Point.setPosition(point, pos)
+        if self.poly == None:
+            self.poly = hou.Geometry.createPolygon(self.geo, False)
+        hou.Face.addVertex(self.poly, point)
+        self.count += 1
+        self.refresh()
+
+    def rebuild(self, vertices):
+        """ Replace the vertices, e.g. after one was removed. 
+        """
+        self.geo = hou.Geometry()
+        self.poly = None
+        self.count = len(vertices)
+        if self.count > 0:
+            hou.Geometry.createPoints(self.geo, [tuple(v) for v in vertices])
+            self.poly = hou.Geometry.createPolygons(self.geo, (tuple(range(self.count)),), False)[0]
+        self.refresh()
+
+    def clear(self):
+        self.rebuild(())
+        self.setText(None)
+        self.show(False, False)
+
+    def moveBand(self, last, cursor, first):
+        hou.Geometry.setPointFloatAttribValues(self.band, "P", tuple(last) + tuple(cursor) + tuple(first))
+        self.band_drawable.setGeometry(self.band)
+
+    def setText(self, text, anchor=None):
+        """ Show text at the world position anchor, pushing it to the text 
+            drawable only if it changed.
+        """
+        if anchor != None:
+            self.anchor = tuple(anchor)
+        if text == self.text: return
+        self.text = text
+        if text != None:
+            hou.TextDrawable.setParams(self.text_drawable, {'text': text})
+
+    def setScale(self, scale):
+        self.text_params['scale'] = hou.Vector3(scale, scale, scale)
 
-    def __getitem__(self, index):
-        return self.measurements[index]
+    def show(self, visible, band):
+        if visible != self.visible:
+            self.visible = visible
+            self.line_drawable.show(visible)
+            self.point_drawable.show(visible)
+            self.text_drawable.show(visible)
+        band = band and visible
+        if band != self.band_visible:
+            self.band_visible = band
+            self.band_drawable.show(band)
+
+    def placeText(self, view):
+        """ Project the text anchor, only when the camera or the anchor moved. 
+        """
+        key = (view.version, self.anchor)
+        if key == self.placed: return
+        self.placed = key
+        screen, in_front = view.toScreen(np.array((self.anchor,)))
+        self.in_front = bool(in_front[0])
+        translate = self.text_params['translate']
+        translate[0] = screen[0, 0]
+        translate[1] = screen[0, 1]
+
+    def draw(self, handle, view):
+        if not self.visible: return
+        hou.GeometryDrawable.draw(self.line_drawable, handle, self.line_params)
+        hou.GeometryDrawable.draw(self.point_drawable, handle, self.point_params)
+        if self.band_visible:
+            hou.GeometryDrawable.draw(self.band_drawable, handle, self.band_params)
+        if self.text != None and self.anchor != None:
+            self.placeText(view)
+            if self.in_front:
+                hou.TextDrawable.draw(self.text_drawable, handle, self.text_params)
+
+def spreadBits(v):
+    """ Spread the low 10 bits of each value so that two zero bits sit 
+        between every pair of bits, for interleaving into Morton codes.
+    """
+    v = v & 0x3ff
+    v = (v | (v << 16)) & 0x030000ff
+    v = (v | (v << 8)) & 0x0300f00f
+    v = (v | (v << 4)) & 0x030c30c3
+    v = (v | (v << 2)) & 0x09249249
+    return v
+
+def mortonCodes(positions):
+    """ 30 bit Morton code of each row of an (n, 3) array, relative to the 
+        bounds of the whole array.
+    """
+    lo = positions.min(axis=0)
+    extent = positions.max(axis=0) - lo
+    extent[extent == 0] = 1.0
+    cells = ((positions - lo) / extent * 1023).astype(np.int64)
+    return (spreadBits(cells[:, 0]) << 2) | (spreadBits(cells[:, 1]) << 1) | spreadBits(cells[:, 2])
+
+def buildBoundsLevels(lo, hi):
+    """ Merge leaf bounds pairwise into an implicit binary tree. Returns a list 
+        of (lo, hi) arrays from the leaves up to the root. Node i of a level 
+        has children 2i and 2i + 1 in the level below.
+    """
+    levels = [(lo, hi)]
+    while len(lo) > 1:
+        if len(lo) % 2:
+            lo = np.vstack((lo, lo[-1:]))
+            hi = np.vstack((hi, hi[-1:]))
+        lo = np.minimum(lo[0::2], lo[1::2])
+        hi = np.maximum(hi[0::2], hi[1::2])
+        levels.append((lo, hi))
+    return levels
+
+def rayBoxHits(origins, inv_dirs, lo, hi, max_t):
+    """ Slab test of each ray against the box paired with it. Returns the 
+        mask of pairs that overlap within max_t along the ray.
+    """
+    t1 = (lo - origins) * inv_dirs
+    t2 = (hi - origins) * inv_dirs
+    t_near = np.maximum(np.minimum(t1, t2).max(axis=1), 0.0)
+    t_far = np.maximum(t1, t2).min(axis=1)
+    return (t_near <= t_far) & (t_near <= max_t)
+
+def walkTree(levels, ray_count, overlaps):
+    """ Descend an implicit bounds tree (see buildBoundsLevels) a level at a 
+        time for a batch of rays. overlaps(rays, lo, hi) returns the mask of 
+        ray/box pairs worth descending into. Returns parallel arrays of ray 
+        index and leaf index for every leaf reached.
+    """
+    rays = np.arange(ray_count)
+    nodes = np.zeros(ray_count, dtype=np.int64)
+    lo, hi = levels[-1]
+    keep = overlaps(rays, lo[nodes], hi[nodes])
+    rays, nodes = rays[keep], nodes[keep]
+    for lo, hi in reversed(levels[:-1]):
+        if len(rays) == 0:
+            break
+        rays = np.repeat(rays, 2)
+        nodes = (nodes[:, None] * 2 + np.arange(2)).ravel()
+        valid = nodes < len(lo)
+        rays, nodes = rays[valid], nodes[valid]
+        keep = overlaps(rays, lo[nodes], hi[nodes])
+        rays, nodes = rays[keep], nodes[keep]
+    return rays, nodes
+
+def safeDirections(directions):
+    """ Replace zero direction components so the slab test can divide by them.
+    """
+    tiny = 1e-12
+    return np.where(np.abs(directions) < tiny, tiny, directions)
+
+class BVH(object):
+    """ Bounding volume hierarchy over triangles. Triangles are sorted along a 
+        Morton curve and grouped into fixed size leaves, which are then merged 
+        pairwise into an implicit binary tree stored as one bounds array per 
+        level. Building and querying are array operations, so a ray costs a 
+        few numpy calls per tree level instead of a Python call per node.
+    """
+    leaf_size = 8
+
+    @staticmethod
+    def readGeometry(geometry):
+        """ Constructor arguments read from geometry. Makes all the hou calls 
+            of a build, so it runs on the main thread, while the constructor 
+            itself is numpy only and can run on a worker.
+        """
+        return extractTriangles(geometry)
+
+    @staticmethod
+    def fromGeometry(geometry):
+        return BVH(*BVH.readGeometry(geometry))
+
+    @staticmethod
+    def empty():
+        return BVH(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+
+    def __init__(self, positions, triangles):
+        self.count = len(triangles)
+        if self.count:
+            corners = positions[triangles]
+            order = np.argsort(mortonCodes(corners.mean(axis=1)), kind='mergesort')
+            triangles = triangles[order]
+        self.triangles = triangles
+        self.refit(positions)
+
+    def refit(self, positions):
+        """ Recompute every bound from new point positions, keeping the 
+            triangle order and tree layout.
+        """
+        self.positions = positions
+        self.levels = []
+        if self.count < 1:
+            return
+        corners = positions[self.triangles]
+        starts = np.arange(0, self.count, BVH.leaf_size)
+        lo = np.minimum.reduceat(corners.min(axis=1), starts, axis=0)
+        hi = np.maximum.reduceat(corners.max(axis=1), starts, axis=0)
+        self.levels = buildBoundsLevels(lo, hi)
+
+    def candidates(self, origins, directions, max_t):
+        """ Walk the tree one level at a time for a batch of rays. Returns 
+            parallel arrays of ray index and triangle index for every triangle 
+            in a leaf the ray passes through.
+        """
+        inv_dirs = 1.0 / safeDirections(directions)
+        def overlaps(rays, lo, hi):
+            return rayBoxHits(origins[rays], inv_dirs[rays], lo, hi, max_t[rays])
+        rays, nodes = walkTree(self.levels, len(origins), overlaps)
+        size = BVH.leaf_size
+        tris = (nodes[:, None] * size + np.arange(size)).ravel()
+        rays = np.repeat(rays, size)
+        valid = tris < self.count
+        return rays[valid], tris[valid]
+
+    def hits(self, origins, directions, max_t=None):
+        """ Every ray/triangle intersection for a batch of rays. Returns arrays 
+            of ray index, triangle index, distance and the (u, v) barycentric 
+            coordinates, unsorted.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        if max_t is None:
+            max_t = np.full(len(origins), np.inf)
+        empty = np.zeros(0, dtype=np.int64)
+        if self.count < 1:
+            return empty, empty, np.zeros(0), np.zeros((0, 2))
+        rays, tris = self.candidates(origins, directions, max_t)
+        o, d = origins[rays], directions[rays]
+        corners = self.positions[self.triangles[tris]]
+        v0 = corners[:, 0]
+        e1 = corners[:, 1] - v0
+        e2 = corners[:, 2] - v0
+        pvec = np.cross(d, e2)
+        det = (e1 * pvec).sum(axis=1)
+        ok = np.abs(det) > 1e-12
+        inv_det = 1.0 / np.where(ok, det, 1.0)
+        tvec = o - v0
+        u = (tvec * pvec).sum(axis=1) * inv_det
+        qvec = np.cross(tvec, e1)
+        v = (d * qvec).sum(axis=1) * inv_det
+        t = (e2 * qvec).sum(axis=1) * inv_det
+        ok &= (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= max_t[rays])
+        return rays[ok], tris[ok], t[ok], np.column_stack((u[ok], v[ok]))
+
+    def nearest(self, origins, directions):
+        """ Closest hit along each ray. Returns the triangle index (-1 for a 
+            miss), distance and barycentric coordinates per ray.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        rays, tris, t, uv = self.hits(origins, directions)
+        count = len(origins)
+        best_tri = np.full(count, -1, dtype=np.int64)
+        best_t = np.full(count, np.inf)
+        best_uv = np.zeros((count, 2))
+        if len(rays):
+            order = np.lexsort((t, rays))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = rays[order][1:] != rays[order][:-1]
+            order = order[first]
+            best_tri[rays[order]] = tris[order]
+            best_t[rays[order]] = t[order]
+            best_uv[rays[order]] = uv[order]
+        return best_tri, best_t, best_uv
+
+class KDTree(object):
+    """ Balanced k-d tree over points for snapping. Each cell is split at the 
+        median along its widest axis, with all cells of a level partitioned in 
+        one vectorized argpartition, so the leaves end up as equal sized runs 
+        of self.order. Node bounds are stored per level like 
+        the BVH's and walked with the same walkTree.
+    """
+    leaf_size = 32
+
+    @staticmethod
+    def readGeometry(geometry):
+        """ Constructor arguments read from geometry, see BVH.readGeometry. 
+        """
+        return (readPositions(geometry),)
+
+    @staticmethod
+    def fromGeometry(geometry):
+        return KDTree(*KDTree.readGeometry(geometry))
+
+    @staticmethod
+    def empty():
+        return KDTree(np.zeros((0, 3)))
+
+    def __init__(self, positions):
+        self.count = len(positions)
+        self.leaves = 1
+        while self.leaves * KDTree.leaf_size < self.count:
+            self.leaves *= 2
+        self.leaf = max(1, -(-self.count // self.leaves))
+        self.order = np.zeros(0, dtype=np.int64)
+        if self.count < 1:
+            self.refit(positions)
+            return
+        order = np.arange(self.leaves * self.leaf, dtype=np.int64)
+        order[self.count:] = self.count - 1 #pad with a repeated point
+        coords = positions[order].astype(np.float32) #kept in the same order as order
+        cell_lo = positions.min(axis=0)[None, :]
+        cell_hi = positions.max(axis=0)[None, :]
+        rows = 1
+        while rows < self.leaves:
+            #split each cell into up to 8 slabs at once, i.e. three tree levels
+            #cut along the same axis, to save passes over the points
+            ways = min(8, self.leaves // rows)
+            segments = coords.reshape(rows, -1, 3)
+            width = segments.shape[1]
+            axis = (cell_hi - cell_lo).argmax(axis=1)
+            values = segments[np.arange(rows)[:, None], :, axis[:, None]].reshape(rows, width)
+            kth = [width * j // ways for j in range(1, ways)]
+            part = np.argpartition(values, kth, axis=1)
+            splits = values[np.arange(rows)[:, None], part[:, kth]]
+            part = (part + (np.arange(rows) * width)[:, None]).ravel()
+            order = order[part]
+            coords = coords[part]
+            cell_lo = np.repeat(cell_lo, ways, axis=0)
+            cell_hi = np.repeat(cell_hi, ways, axis=0)
+            for j in range(ways):
+                if j > 0:
+                    cell_lo[j::ways][np.arange(rows), axis] = splits[:, j - 1]
+                if j < ways - 1:
+                    cell_hi[j::ways][np.arange(rows), axis] = splits[:, j]
+            rows *= ways
+        self.order = order
+        self.refit(positions)
+
+    def refit(self, positions):
+        """ Recompute the bounds from new positions, keeping the tree layout.
+        """
+        self.positions = positions
+        self.levels = []
+        if self.count < 1:
+            return
+        lo = np.empty((self.leaves, 3))
+        hi = np.empty((self.leaves, 3))
+        for axis in range(3):
+            coords = positions[self.order, axis].reshape(self.leaves, self.leaf)
+            lo[:, axis] = coords.min(axis=1)
+            hi[:, axis] = coords.max(axis=1)
+        self.levels = buildBoundsLevels(lo, hi)
+
+    def nearestToRays(self, origins, directions, radius, max_t=None):
+        """ Point that looks closest to each ray, among points within a cone 
+            of radius[0] + radius[1] * t around it, where t is the distance 
+            along the ray and at most max_t. Returns the point numbers, -1 for 
+            rays with none in range.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        directions = directions / np.sqrt((directions ** 2).sum(axis=1))[:, None]
+        count = len(origins)
+        if max_t is None:
+            max_t = np.full(count, np.inf)
+        nearest = np.full(count, -1, dtype=np.int64)
+        if self.count < 1:
+            return nearest
+        inv_dirs = 1.0 / safeDirections(directions)
+        def overlaps(rays, lo, hi):
+            half_diagonal = np.sqrt(((hi - lo) ** 2).sum(axis=1)) * 0.5
+            t_far = np.maximum((((lo + hi) * 0.5 - origins[rays]) * directions[rays]).sum(axis=1) + half_diagonal, 0.0)
+            grow = (radius[0] + radius[1] * t_far)[:, None]
+            return rayBoxHits(origins[rays], inv_dirs[rays], lo - grow, hi + grow, max_t[rays])
+        rays, leaves = walkTree(self.levels, count, overlaps)
+        if len(leaves) == 0:
+            return nearest
+        rays = np.repeat(rays, self.leaf)
+        points = self.order[(leaves[:, None] * self.leaf + np.arange(self.leaf)).ravel()]
+        offset = self.positions[points] - origins[rays]
+        t = (offset * directions[rays]).sum(axis=1)
+        perpendicular = np.sqrt(np.maximum((offset * offset).sum(axis=1) - t * t, 0.0))
+        allowed = radius[0] + radius[1] * t
+        ok = (t > 0) & (t <= max_t[rays]) & (perpendicular <= allowed)
+        rays, points, t = rays[ok], points[ok], t[ok]
+        score = perpendicular[ok] / np.maximum(allowed[ok], 1e-12)
+        order = np.lexsort((t, score, rays)) #best candidate first within each ray
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = rays[order][1:] != rays[order][:-1]
+        nearest[rays[order][first]] = points[order][first]
+        return nearest
+
+def extractTriangles(geometry):
+    """ Triangulate a copy of geometry with SOP verbs and read it back in bulk.
+        Returns the point positions and the (n, 3) point indices of every 
+        triangle. Anything that is not a closed polygon is skipped.
+    """
+    category = hou.sopNodeTypeCategory()
+    divided = hou.Geometry()
+    divide_verb = category.nodeVerb("divide")
+    hou.SopVerb.setParms(divide_verb, {'convex': 1, 'usemaxsides': 1, 'numsides': 3})
+    hou.SopVerb.execute(divide_verb, divided, [geometry])
+
+    corners = hou.Geometry()
+    corner_verb = category.nodeVerb("attribwrangle")
+    hou.SopVerb.setParms(corner_verb, {'class': 1, 'snippet': 
+        'int pts[] = primpoints(0, @primnum);\n'
+        'int tri = len(pts) == 3 && primintrinsic(0, "typename", @primnum) == "Poly" '
+        '&& primintrinsic(0, "closed", @primnum);\n'
+        'i@__ruler_p0 = tri ? pts[0] : -1;\n'
+        'i@__ruler_p1 = tri ? pts[1] : -1;\n'
+        'i@__ruler_p2 = tri ? pts[2] : -1;\n'})
+    hou.SopVerb.execute(corner_verb, corners, [divided])
+
+    positions = readPositions(corners)
+    triangles = np.column_stack([np.frombuffer(hou.Geometry.primIntAttribValuesAsString(corners, name), dtype=np.int32) 
+        for name in ("__ruler_p0", "__ruler_p1", "__ruler_p2")]).astype(np.int64)
+    return positions, triangles[triangles[:, 0] >= 0]
+
+def readPositions(geometry):
+    """ Point positions of geometry as an (n, 3) float64 array.
+    """
+    data = hou.Geometry.pointFloatAttribValuesAsString(geometry, "P")
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, 3).astype(np.float64)
+
+class MeasureEngine(object):
+    """ The measuring rules of the viewer state without any UI, for use from 
+        hython as well as by the State. Rays are cast against a BVH of the 
+        geometry, can snap to points through a KDTree, and fall back to the 
+        principal planes through the origin when they miss. All queries take 
+        arrays with one row per ray and return arrays.
+
+            engine = ruler.MeasureEngine.fromGeometry(node.geometry())
+            tails, _ = engine.intersect(tail_origins, tail_directions)
+            heads, _ = engine.intersect(head_origins, head_directions)
+            ruler.exportMeasurements(engine.store(tails, heads), "lengths.csv")
+    """
+    normals = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+    plane_to_next = ((0.0, 0.0, -1.0), (1.0, 0.0, 0.0), (1.0, 0.0, 0.0)) #angle zero direction in each plane
+
+    def __init__(self, bvh=None, tree=None):
+        self.bvh = bvh
+        self.tree = tree
+
+    @staticmethod
+    def fromGeometry(geometry, point_snap=False):
+        tree = KDTree.fromGeometry(geometry) if point_snap else None
+        return MeasureEngine(BVH.fromGeometry(geometry), tree)
+
+    @staticmethod
+    def bestPlanes(directions):
+        """ Principal plane facing each direction the most. 
+        """
+        return np.abs(np.asarray(directions, dtype=np.float64).reshape(-1, 3)).argmax(axis=1)
+
+    @staticmethod
+    def intersectPlanes(origins, directions, planes):
+        """ Where each line crosses its principal plane through the origin. 
+        """
+        rows = np.arange(len(origins))
+        t = -origins[rows, planes] / safeDirections(directions)[rows, planes]
+        return origins + directions * t[:, None]
+
+    def intersect(self, origins, directions, planes=None, snap_radius=None, snap_corners=False):
+        """ Hit position of each ray and the plane it landed on, -1 where it 
+            hit the geometry. With snap_radius, an (a, b) pair giving a snap 
+            distance of a + b * t at distance t along the ray, rays snap to the 
+            tree point closest to them. With snap_corners, hits that did not 
+            snap to a point move to the nearest corner of their triangle. Rays 
+            missing the geometry land on planes, by default the ones 
+            bestPlanes picks.
+        """
+        return self.intersectAnchored(origins, directions, planes, snap_radius, snap_corners)[:2]
+
+    def intersectAnchored(self, origins, directions, planes=None, snap_radius=None, snap_corners=False):
+        """ intersect that also returns where each hit sits on the geometry: 
+            an (n, 3) array of point numbers, the corners of the triangle hit 
+            or the snapped point three times, and an (n, 3) array of their 
+            weights. Points are -1 for rays that landed on a plane. The hit 
+            follows the geometry as it deforms, see evaluateAnchors.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        directions = directions / np.sqrt((directions ** 2).sum(axis=1))[:, None]
+        count = len(origins)
+        if planes is None:
+            planes = MeasureEngine.bestPlanes(directions)
+        planes = np.asarray(planes, dtype=np.int64).reshape(count)
+        positions = np.empty((count, 3))
+        hit_planes = planes.copy()
+        points = np.full((count, 3), -1, dtype=np.int64)
+        weights = np.zeros((count, 3))
+        if self.bvh != None:
+            tris, t, uv = self.bvh.nearest(origins, directions)
+        else:
+            tris, t = np.full(count, -1), np.full(count, np.inf)
+        hit = tris >= 0
+        positions[hit] = origins[hit] + directions[hit] * t[hit, None]
+        hit_planes[hit] = -1
+        if hit.any():
+            points[hit] = self.bvh.triangles[tris[hit]]
+            weights[hit] = np.column_stack((1.0 - uv[hit].sum(axis=1), uv[hit]))
+        snapped = np.zeros(count, dtype=bool)
+        if self.tree != None and snap_radius != None:
+            max_t = np.where(hit, t + snap_radius[0] + snap_radius[1] * t, np.inf)
+            nearest = self.tree.nearestToRays(origins, directions, snap_radius, max_t)
+            snapped = nearest >= 0
+            positions[snapped] = self.tree.positions[nearest[snapped]]
+            points[snapped] = nearest[snapped, None]
+        if self.bvh != None and snap_corners:
+            corner_rows = np.flatnonzero(hit & ~snapped)
+            corners = self.bvh.triangles[tris[corner_rows]]
+            closest = ((self.bvh.positions[corners] - positions[corner_rows, None]) ** 2).sum(axis=2).argmin(axis=1)
+            points[corner_rows] = corners[np.arange(len(corner_rows)), closest][:, None]
+            positions[corner_rows] = self.bvh.positions[points[corner_rows, 0]]
+            snapped[corner_rows] = True
+        weights[snapped] = (1.0, 0.0, 0.0)
+        hit_planes[snapped] = -1
+        miss = hit_planes >= 0
+        positions[miss] = MeasureEngine.intersectPlanes(origins[miss], directions[miss], planes[miss])
+        return positions, hit_planes, points, weights
+
+    @staticmethod
+    def evaluateAnchors(positions, points, weights):
+        """ Positions of anchors given as (n, 3) point numbers and weights on 
+            the (m, 3) point positions of the current frame. 
+        """
+        return (positions[points] * weights[:, :, None]).sum(axis=1)
+
+    def snapAngles(self, tails, targets, planes, origins, step):
+        """ Angle snapping for measurements from tails towards targets in the 
+            given planes, seen from the camera positions origins. The angle in 
+            the plane is rounded to a multiple of step degrees and a ray for it 
+            and for its two neighbours is cast across the plane, keeping the 
+            hit closest to the target. If the ray for the rounded angle misses 
+            the geometry, its point on the plane competes with those hits. 
+            Returns positions, the angle used and the plane landed on (-1 for 
+            a geometry hit) per row.
+        """
+        tails = np.asarray(tails, dtype=np.float64).reshape(-1, 3)
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        planes = np.asarray(planes, dtype=np.int64).reshape(-1)
+        count = len(tails)
+        rows = np.arange(count)
+        normals = np.array(MeasureEngine.normals)[planes]
+        zero = np.array(MeasureEngine.plane_to_next)[planes]
+
+        vecs = targets - tails
+        vecs[rows, planes] = 0 #project onto plane
+        lengths = np.sqrt((vecs ** 2).sum(axis=1))
+        cos = (vecs * zero).sum(axis=1) / np.where(lengths > 0, lengths, 1.0)
+        angles = np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+        below = np.floor(angles / step) * step
+        closest = np.where(angles - below < step * 0.5, below, below + step)
+        flip = (np.cross(zero, vecs) * normals).sum(axis=1) < 0
+        closest = np.where(flip, 360 - closest, closest).astype(np.int64)
+        directions = np.where(((normals * origins).sum(axis=1) < 0)[:, None], normals, -normals)
+
+        candidates = np.stack((closest, (closest - step) % 360, (closest + step) % 360), axis=1)
+        radians = np.radians(candidates)[:, :, None]
+        #rotating zero about the normal it is perpendicular to
+        turned = zero[:, None] * np.cos(radians) + np.cross(normals, zero)[:, None] * np.sin(radians)
+        starts = tails[:, None] + turned * lengths[:, None, None]
+        starts[rows, :, planes] = origins[rows, planes][:, None]
+
+        positions = MeasureEngine.intersectPlanes(starts[:, 0], directions, planes)
+        chosen = closest.copy()
+        landed = planes.copy()
+        if self.bvh == None:
+            return positions, chosen, landed
+        flat_starts = starts.reshape(-1, 3)
+        flat_directions = np.repeat(directions, 3, axis=0)
+        rays, tris, t, uv = self.bvh.hits(flat_starts, flat_directions)
+        if len(rays) == 0:
+            return positions, chosen, landed
+        hits = flat_starts[rays] + flat_directions[rays] * t[:, None]
+        owner = rays // 3
+        distance = ((hits - targets[owner]) ** 2).sum(axis=1)
+        order = np.lexsort((distance, owner))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = owner[order][1:] != owner[order][:-1]
+        best = order[first]
+        #where the closest angle's ray misses the geometry its plane point is 
+        #a candidate too, so a far neighbour hit cannot beat it
+        closest_hit = np.zeros(count, dtype=bool)
+        closest_hit[owner[rays % 3 == 0]] = True
+        plane_distance = ((positions - targets) ** 2).sum(axis=1)
+        best = best[closest_hit[owner[best]] | (distance[best] < plane_distance[owner[best]])]
+        positions[owner[best]] = hits[best]
+        chosen[owner[best]] = candidates.reshape(-1)[rays[best]]
+        landed[owner[best]] = -1
+        return positions, chosen, landed
+
+    def store(self, tails, heads, planes=None, angles=None):
+        """ MeasurementStore of the segments from tails to heads, ready for 
+            exportMeasurements. 
+        """
+        return MeasurementStore.fromArrays(tails, heads, planes, angles)
+
+class BackgroundBuild(object):
+    """ Runs builder(*args) on a daemon worker thread. on_done, if given, is 
+        called on the main thread once the result or error is available.
+    """
+    def __init__(self, builder, args, on_done=None):
+        self.result = None
+        self.error = None
+        self.on_done = on_done
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(builder, args))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, builder, args):
+        try:
+            self.result = builder(*args)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+            if self.on_done != None and hdefereval != None:
+                hdefereval.executeDeferred(self.on_done)
+
+    def ready(self):
+        return self.done.is_set()
+
+index_cache = {} #(node path, index class) -> (cook count, data ids, index)
+index_builds = {} #(node path, index class) -> (cook count, data ids, BackgroundBuild)
+
+def keepNodeIndices(path):
+    """ Drop the cached indices and pending builds of every node but path, 
+        so only the node being measured holds memory. Its indices are still 
+        reused when the state is entered on it again.
+    """
+    for cache in (index_cache, index_builds):
+        for key in [k for k in cache if k[0] != path]:
+            del cache[key]
+
+def geometryDataIds(geometry):
+    """ (topology, positions) data ids of geometry. A SOP keeps the data ids 
+        of whatever it leaves untouched, so a recook that only moves points, 
+        like a deformer scrubbed along the timeline, changes the second but 
+        not the first.
+    """
+    topology = (hou.Geometry.topologyDataId(geometry), hou.Geometry.primitiveListDataId(geometry))
+    return topology, hou.Attrib.dataId(hou.Geometry.findPointAttrib(geometry, "P"))
+
+def refitNodeIndex(key, geometry, cook, ids):
+    """ The cached index for key carried over to a new cook of the same 
+        topology, refit in place if the points moved. None if there is no 
+        cached index or the topology changed, which needs a full build.
+    """
+    cached = index_cache.get(key)
+    if cached == None or cached[1][0] != ids[0]:
+        return None
+    index = cached[2]
+    if cached[1][1] != ids[1]:
+        index.refit(readPositions(geometry))
+    index_cache[key] = (cook, ids, index)
+    return index
+
+def getNodeIndex(node, index_type):
+    """ index_type (BVH or KDTree) over the cooked geometry of a SOP node. 
+        Refit when a recook only moved points, rebuilt when the topology 
+        changed. Blocks until built.
+    """
+    key = (node.path(), index_type)
+    keepNodeIndices(key[0])
+    cook = hou.Node.cookCount(node)
+    cached = index_cache.get(key)
+    if cached != None and cached[0] == cook:
+        return cached[2]
+    geometry = hou.SopNode.geometry(node)
+    ids = geometryDataIds(geometry)
+    index = refitNodeIndex(key, geometry, cook, ids)
+    if index == None:
+        index = index_type.fromGeometry(geometry)
+        index_cache[key] = (cook, ids, index)
+    return index
+
+def requestNodeIndex(node, index_type, on_done=None):
+    """ Non-blocking getNodeIndex. Recooks that keep the topology are refit 
+        right away. Otherwise the geometry is read into arrays here, on the 
+        main thread, since hou calls from other threads only wait on the 
+        main thread's HOM lock, and the index is built from the arrays on a 
+        worker thread. Returns None until that build has finished and the 
+        index after. A build already running for the same topology is 
+        waited for and refit rather than started over.
+    """
+    key = (node.path(), index_type)
+    keepNodeIndices(key[0])
+    cook = hou.Node.cookCount(node)
+    cached = index_cache.get(key)
+    if cached != None and cached[0] == cook:
+        return cached[2]
+    geometry = hou.SopNode.geometry(node)
+    ids = geometryDataIds(geometry)
+    index = refitNodeIndex(key, geometry, cook, ids)
+    if index != None:
+        return index
+    build = index_builds.get(key)
+    if build == None or build[1][0] != ids[0]:
+        try:
+            args = index_type.readGeometry(geometry)
+        except hou.Error as e:
+            return indexFailed(key, node, index_type, cook, ids, e)
+        index_builds[key] = (cook, ids, BackgroundBuild(index_type, args, on_done))
+        return None
+    if not build[2].ready():
+        return None
+    del index_builds[key]
+    if build[2].error != None:
+        indexFailed(key, node, index_type, build[0], build[1], build[2].error)
+    else:
+        index_cache[key] = (build[0], build[1], build[2].result)
+    return refitNodeIndex(key, geometry, cook, ids)
+
+def indexFailed(key, node, index_type, cook, ids, error):
+    """ Report a failed build and cache an empty index in its place, so it 
+        is not retried until the topology changes.
+    """
+    hou.ui.setStatusMessage("Ruler could not index {}: {}".format(node.path(), error), hou.severityType.Warning)
+    index = index_type.empty()
+    index_cache[key] = (cook, ids, index)
+    return index
+
+def getNodeBVH(node):
+    return getNodeIndex(node, BVH)
+
+def requestNodeBVH(node, on_done=None):
+    return requestNodeIndex(node, BVH, on_done)
+
+class SampleEnds(object):
+    """ The ends of the measurements sampled over a frame range, a tail and a 
+        head per measurement. An end is either fixed or a weighted sum of 
+        point positions, kept as one flat run of point numbers and weights per 
+        end, so all ends of a frame come out of one gather and one reduceat. 
+        Saved to a .npz file to hand to the worker processes.
+    """
+    def __init__(self, fixed, points, weights, counts, names=None):
+        self.fixed = np.asarray(fixed, dtype=np.float64).reshape(-1, 3) #(2n, 3) tails and heads interleaved
+        self.points = np.asarray(points, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int64) #points per end, 0 for a fixed end
+        self.names = list(names) if names != None else ["distance{}".format(i) for i in range(len(self.fixed) // 2)]
+
+    @staticmethod
+    def fromStore(store):
+        """ Ends of every measurement in store, following their anchors and 
+            fixed where they have none. 
+        """
+        fixed = store.endpoints()
+        points = np.empty((store.count * 2, 3), dtype=np.int64)
+        points[0::2] = store.records['tail_points'][:store.count]
+        points[1::2] = store.records['head_points'][:store.count]
+        weights = np.empty((store.count * 2, 3))
+        weights[0::2] = store.records['tail_weights'][:store.count]
+        weights[1::2] = store.records['head_weights'][:store.count]
+        anchored = points[:, 0] >= 0
+        counts = np.where(anchored, 3, 0)
+        names = [name.decode('utf-8') or "distance{}".format(i) for i, name in enumerate(store.records['name'][:store.count])]
+        return SampleEnds(fixed, points[anchored].ravel(), weights[anchored].ravel(), counts, names)
+
+    @staticmethod
+    def fromGroups(geometry, pairs):
+        """ Ends at the centroids of named point groups of geometry, one 
+            measurement per (tail group, head group) pair. 
+        """
+        points, counts = [], []
+        for pair in pairs:
+            for name in pair:
+                group = hou.Geometry.findPointGroup(geometry, name)
+                if group == None:
+                    raise ValueError("No point group '{}'".format(name))
+                members = [hou.Point.number(p) for p in hou.PointGroup.points(group)]
+                if len(members) < 1:
+                    raise ValueError("Point group '{}' is empty".format(name))
+                points.extend(members)
+                counts.append(len(members))
+        counts = np.array(counts, dtype=np.int64)
+        weights = np.repeat(1.0 / np.maximum(counts, 1), counts)
+        names = ["{}_{}".format(*pair) for pair in pairs]
+        return SampleEnds(np.zeros((len(counts), 3)), points, weights, counts, names)
+
+    def evaluate(self, positions):
+        """ (2n, 3) end positions on the point positions of one frame. 
+        """
+        ends = self.fixed.copy()
+        moving = self.counts > 0
+        if moving.any():
+            starts = np.concatenate(([0], np.cumsum(self.counts[moving])[:-1]))
+            ends[moving] = np.add.reduceat(positions[self.points] * self.weights[:, None], starts, axis=0)
+        return ends
+
+    def lengths(self, positions):
+        ends = self.evaluate(positions)
+        return np.sqrt(((ends[1::2] - ends[0::2]) ** 2).sum(axis=1))
+
+    def save(self, path):
+        np.savez(path, fixed=self.fixed, points=self.points, weights=self.weights, counts=self.counts, 
+                names=np.array([name.encode('utf-8') for name in self.names]))
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        return SampleEnds(data['fixed'], data['points'], data['weights'], data['counts'], 
+                [name.decode('utf-8') for name in data['names']])
+
+def sampleFrames(node, ends, frames, path):
+    """ Measure ends on the cooked geometry of node at each of frames in turn, 
+        appending a "frame,length,..." line to path as soon as a frame is done.
+    """
+    with open(path, 'w') as f:
+        for frame in frames:
+            hou.setFrame(frame)
+            lengths = ends.lengths(readPositions(hou.SopNode.geometry(node)))
+            f.write(",".join(["%.12g" % frame] + ["%.12g" % l for l in lengths.tolist()]) + "\n")
+            f.flush()
+
+class FrameRangeSampler(object):
+    """ Measures lengths over a frame range in worker hython processes running 
+        sampleFrames on the saved hip file. The range is split into one 
+        contiguous chunk per worker, since simulations have to cook their 
+        frames in order, and every worker streams its lines to its own part 
+        file. poll() reads the finished lines, so the curves fill in while the 
+        workers run, and the part files are merged into one CSV at the end.
+    """
+    workers = 4
+    hython = None #defaults to $HFS/bin/hython
+    poll_interval = 0.5 #seconds between reads of the part files
+
+    def __init__(self, node, ends, frames, path, workers=None):
+        self.node = node
+        self.ends = ends
+        self.frames = list(frames)
+        self.path = path
+        self.workers = max(1, min(workers or FrameRangeSampler.workers, len(self.frames)))
+        self.processes = []
+        self.part_paths = []
+        self.offsets = []
+        self.sampled = {} #frame -> lengths
+        self.on_rows = None
+        self.poll_time = 0.0
+
+    @staticmethod
+    def script():
+        return os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+
+    def start(self, on_rows=None):
+        """ Launch the workers. on_rows, if given, is called with the frames 
+            and (frames, measurements) lengths of every batch of lines read 
+            by the event loop callback until all workers have finished.
+        """
+        hython = FrameRangeSampler.hython or os.path.join(os.environ.get("HFS", ""), "bin", "hython")
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        ends_path = self.path + ".ends.npz"
+        self.ends.save(ends_path)
+        hip = hou.hipFile.path()
+        for i, chunk in enumerate(np.array_split(np.array(self.frames, dtype=np.float64), self.workers)):
+            part_path = "{}.{}.part".format(self.path, i)
+            open(part_path, 'w').close() #exists before the worker gets to it, for poll
+            with open(part_path + ".log", 'w') as log:
+                args = [hython, FrameRangeSampler.script(), "sample", hip, self.node.path(), ends_path, part_path]
+                self.processes.append(subprocess.Popen(args + ["%.12g" % f for f in chunk.tolist()], 
+                        stdout=log, stderr=subprocess.STDOUT))
+            self.part_paths.append(part_path)
+            self.offsets.append(0)
+        self.on_rows = on_rows
+        if on_rows != None:
+            hou.ui.addEventLoopCallback(self.onEventLoop)
+
+    def running(self):
+        return any(p.poll() == None for p in self.processes)
+
+    def failed(self):
+        """ Log files of the workers that exited with an error. 
+        """
+        return [path + ".log" for path, p in zip(self.part_paths, self.processes) if p.poll() not in (None, 0)]
+
+    def poll(self):
+        """ Lines finished since the last call, as an array of frames and an 
+            array of lengths with a row per frame. Partly written lines are 
+            left for the next call.
+        """
+        lines = []
+        for i, path in enumerate(self.part_paths):
+            with open(path) as f:
+                f.seek(self.offsets[i])
+                data = f.read()
+            complete = data.rfind("\n") + 1
+            self.offsets[i] += complete
+            lines.extend(data[:complete].splitlines())
+        if len(lines) < 1:
+            return np.zeros(0), np.zeros((0, len(self.ends.names)))
+        table = np.array([line.split(",") for line in lines], dtype=np.float64).reshape(len(lines), -1)
+        for row in table:
+            self.sampled[row[0]] = row[1:]
+        return table[:, 0], table[:, 1:]
+
+    def onEventLoop(self):
+        now = time.time()
+        if now - self.poll_time < FrameRangeSampler.poll_interval:
+            return
+        self.poll_time = now
+        finished = not self.running()
+        frames, lengths = self.poll()
+        if len(frames):
+            self.on_rows(frames, lengths)
+        if finished:
+            hou.ui.removeEventLoopCallback(self.onEventLoop)
+            self.finish()
+            failed = self.failed()
+            if failed:
+                hou.ui.setStatusMessage("Sampling failed in {} of {} workers, see {}".format(len(failed), len(self.processes), failed[0]), 
+                        hou.severityType.Error)
+            else:
+                hou.ui.setStatusMessage("Sampled {} frames into {}".format(len(self.sampled), self.path))
+
+    def finish(self):
+        """ Merge everything sampled into self.path, one row per frame in 
+            frame order, and remove the part files of workers that succeeded.
+        """
+        frames = sorted(self.sampled)
+        with open(self.path, 'w') as f:
+            f.write(",".join(["frame"] + self.ends.names) + "\n")
+            for frame in frames:
+                f.write(",".join(["%.12g" % frame] + ["%.12g" % l for l in self.sampled[frame].tolist()]) + "\n")
+        failed = self.failed()
+        for path in self.part_paths:
+            if path + ".log" not in failed:
+                os.remove(path)
+                os.remove(path + ".log")
+        os.remove(self.path + ".ends.npz")
+
+def keySampleChannels(node, names, frames, lengths):
+    """ Key the sampled lengths on float spare parameters of node, one per 
+        measurement, so they can be inspected as curves in the Animation 
+        Editor. Missing parameters are added.
+    """
+    for i, name in enumerate(names):
+        parm_name = "ruler_" + "".join(c if c.isalnum() else "_" for c in name)
+        parm = hou.Node.parm(node, parm_name)
+        if parm == None:
+            hou.Node.addSpareParmTuple(node, hou.FloatParmTemplate(parm_name, name, 1))
+            parm = hou.Node.parm(node, parm_name)
+        keys = []
+        for frame, value in zip(frames.tolist(), lengths[:, i].tolist()):
+            key = hou.Keyframe(value)
+            key.setFrame(frame)
+            keys.append(key)
+        hou.Parm.setKeyframes(parm, keys)
+
+def sampleMain(argv):
+    """ Worker entry point, run as
+            hython ruler.py sample <hip file> <node path> <ends file> <part file> <frame>...
+    """
+    hip, node_path, ends_path, part_path = argv[:4]
+    hou.hipFile.load(hip, suppress_save_prompt=True, ignore_load_warnings=True)
+    node = hou.node(node_path)
+    if node == None:
+        raise ValueError("No node {} in {}".format(node_path, hip))
+    sampleFrames(node, SampleEnds.load(ends_path), [float(f) for f in argv[4:]], part_path)
 
 class Intersection():
-    def __init__(self, pos, plane):
+    def __init__(self, pos, plane, anchor=None):
         self.pos = pos
         self.has_plane = (plane != None)
         self.plane = plane
+        self.anchor = anchor
+
+class PointerSample(object):
+    """ The parts of a mouse event that intersection and updates read, copied 
+        out so the event can be processed after its callback has returned.
+    """
+    def __init__(self, ui_event):
+        self.origin, self.direction = hou.ViewerEvent.ray(ui_event)
+        snapping_dict = hou.ViewerEvent.snappingRay(ui_event)
+        self.snap_origin = snapping_dict["origin_point"]
+        self.snap_direction = snapping_dict["direction"]
+        device = hou.UIEvent.device(ui_event)
+        self.mouse_x = device.mouseX()
+        self.mouse_y = device.mouseY()
+
+class UpdateScheduler(object):
+    """ Coalesces drag samples so the expensive update runs at most once per 
+        interval. Newer samples replace the pending one; the pending sample is 
+        handed out once the interval has passed.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = None
+        self.last = 0.0
+
+    def submit(self, sample):
+        """ Queue sample. Returns it if it is due now, otherwise None. 
+        """
+        self.pending = sample
+        return self.due()
+
+    def due(self):
+        if self.pending == None:
+            return None
+        now = time.time()
+        if now - self.last < self.interval:
+            return None
+        sample = self.pending
+        self.pending = None
+        self.last = now
+        return sample
+
+    def cancel(self):
+        self.pending = None
 
 class Mode:
     doing_nothing = 0 
     pre_measurement = 1
     measuring = 2
+    picking = 3 #placing the vertices of a Shape other than distance
+
+class Shape:
+    distance = 0
+    polyline = 1
+    area = 2
+    angle = 3
+
+    labels = {polyline: u"Length {}", area: u"Area {}", angle: u"{}\u00b0"}
 
 class State(object):
-    msg = """
+    msg = None #formatted with the hotkey assignments on first use, see getMessage
+    indexing_msg = """    Indexing geometry... measuring against the principal planes until it is ready.
+    """
+    
+    planes = (hou.Vector3(1, 0, 0), hou.Vector3(0, 1, 0), hou.Vector3(0, 0, 1))
+    text_size = 1.0 #mutable by changing the text size parm
+    lod_length = 20.0 #screen length in pixels below which labels and disks are dropped
+    snap_radius = 12.0 #pixels around the cursor searched when snapping to points
+    update_interval = 1.0 / 60 #seconds between drag updates, extra events are coalesced
+    hud_interval = 0.5 #seconds between profiling HUD refreshes
+    hud_lines = 12
+    angle_step = 15
+    arc_table = None #arc geometry per snapped angle, see getArcGeometry
+    angle_labels = None #label HTML per snapped angle, see getAngleLabel
+
+    @staticmethod
+    def getMessage():
+        if State.msg == None:
+            Key.register()
+            State.msg = """
     Click and drag on the geometry to measure it.
     Press the '{}' key to copy the last measurement to clip board.
     Press the '{}' key to undo the most recent measurement.
     Press the '{}' key to copy to clip and remove last measurement.
+    Press the '{}' key to export all measurements to a file.
+    Press the '{}' key to measure all measurements over the frame range.
+    Press the '{}' key to finish a polyline or area.
     Hold down the Ctrl key to turn on angle snapping.
-    """.format(hou.hotkeys.assignments(Key.copy_to_clip)[0], hou.hotkeys.assignments(Key.undo)[0], hou.hotkeys.assignments(Key.pop_copy)[0])
-    
-    planes = (hou.Vector3(1, 0, 0), hou.Vector3(0, 1, 0), hou.Vector3(0, 0, 1))
-    plane_to_next = {Plane.X : hou.Vector3(0, 0, -1), Plane.Y : hou.Vector3(1, 0, 0), Plane.Z : hou.Vector3(1, 0, 0)}
-    text_size = 1.0 #mutable by changing the text size parm
+    """.format(hou.hotkeys.assignments(Key.copy_to_clip)[0], hou.hotkeys.assignments(Key.undo)[0], hou.hotkeys.assignments(Key.pop_copy)[0], 
+                    hou.hotkeys.assignments(Key.export)[0], hou.hotkeys.assignments(Key.sample_range)[0], 
+                    hou.hotkeys.assignments(Key.finish_shape)[0])
+        return State.msg
 
     def __init__(self, state_name, scene_viewer):
+        Key.register()
         self.state_name = state_name
         self.scene_viewer = scene_viewer
         self.geometry_viewport = hou.SceneViewer.curViewport(self.scene_viewer)
-        self.geo_intersector = None
+        self.view = ViewTransforms(self.geometry_viewport)
+        self.engine = MeasureEngine()
+        self.indexing = False
+        self.point_snap = False
+        self.anchor = False
+        self.anchor_cook = None #cook count the anchored measurements were last moved to
+        self.sampler = None
+        self.sample_node = None
+        self.saved = None #(store, version) as last restored or saved, see saveMeasurements
+        self.shape = Shape.distance
+        self.totals = ShapeTotals()
+        self.shape_drawing = None #created with the first shape
         self.geometry = None
-        self.measurements = MeasurementContainer(self.geometry_viewport, State.text_size)
+        self.measurements = MeasurementContainer(self.scene_viewer, self.geometry_viewport, State.text_size, State.lod_length)
         self.current_node = None
         self.curPlane = None
         self.show(False)
         self.angle_snapping = False
         self.cur_angle = 0
-        point = createPointGeometry()
+        self.arc_angle = None
+        point = getTemplateGeometry(createPointGeometry)
         self.point_drawable = hou.GeometryDrawable(scene_viewer, hou.drawableGeometryType.Point, "point", point)
         self.point_params = {'style': hou.drawableGeometryPointStyle.SmoothCircle, 'radius': 2, 'color2': hou.Vector4(0, 1, 1, 1),
                 'color1' : hou.Vector4(.9, .8, .1, 1.), 'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width': 20}
         self.active = False
         self.angle_text_drawable = hou.TextDrawable(self.scene_viewer, "angle_text")
-        self.angle_text_params = {'text': "Fizz", 'translate': hou.Vector3(0.0, 0.0, 0.0),'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':10, 'color2':hou.Vector4(0,0,0,0.5) }
+        self.angle_text_params = {'translate': hou.Vector3(0.0, 0.0, 0.0),'highlight_mode':hou.drawableHighlightMode.MatteOverGlow, 'glow_width':10, 'color2':hou.Vector4(0,0,0,0.5) }
         self.arc_drawable = hou.GeometryDrawable(self.scene_viewer, hou.drawableGeometryType.Line, "arc")
         self.mode = Mode.doing_nothing
+        self.scheduler = UpdateScheduler(State.update_interval)
+        self.flush_scheduled = False
+        self.hud_drawable = hou.TextDrawable(self.scene_viewer, "profile_hud")
+        self.hud_params = {'text': "", 'translate': hou.Vector3(10.0, 0.0, 0.0), 'color2':hou.Vector4(0,0,0,0.5)}
+        self.hud_time = 0.0
                 
     def show(self, visible):
         """ Display or hide drawables.
@@ -499,19 +2413,45 @@ class State(object):
             self.measurements.showAll()
         else:
             self.measurements.hideAll()
+        if self.shape_drawing != None:
+            self.shape_drawing.show(visible and self.totals.count() > 0, visible and self.mode == Mode.picking)
 
     def setActive(self, val):
         self.active = val
         hou.GeometryDrawable.show(self.point_drawable, not val)
 
+    @staticmethod
+    def getArcGeometry(angle):
+        """ Look up the arc for a snapped angle. The table holds one arc per 
+            multiple of angle_step and is filled on first use.
+        """
+        if State.arc_table == None:
+            State.arc_table = [getTemplateGeometry(createArcGeometry, a, 1) 
+                    for a in range(0, 361, State.angle_step)]
+        return State.arc_table[angle // State.angle_step]
+
+    @staticmethod
+    def getAngleLabel(angle):
+        """ Look up the label for a snapped angle, from a table filled on 
+            first use like the arcs.
+        """
+        if State.angle_labels == None:
+            State.angle_labels = [u'<font size="30"><b> {0}\u00b0 </b></font>'.format(a) 
+                    for a in range(0, 361, State.angle_step)]
+        return State.angle_labels[angle // State.angle_step]
+
     def drawAngle(self, angle_snapping_on, handle):
         if not angle_snapping_on: 
             return
         if (self.curPlane == None):
             return
+        if self.measurements.active == None:
+            return #snapping only applies to a measurement being drawn out
         plane_vec = State.planes[self.curPlane]
-        arc_geo = createArcGeometry(self.cur_angle, 1)
-        hou.GeometryDrawable.setGeometry(self.arc_drawable, arc_geo)
+        if self.arc_angle != self.cur_angle:
+            hou.GeometryDrawable.setGeometry(self.arc_drawable, State.getArcGeometry(self.cur_angle))
+            hou.TextDrawable.setParams(self.angle_text_drawable, {'text': State.getAngleLabel(self.cur_angle)})
+            self.arc_angle = self.cur_angle
 
         color = hou.Vector4(plane_vec[0], plane_vec[1], plane_vec[2], 1)
         scale = self.measurements.current().getLength() * .5
@@ -523,10 +2463,6 @@ class State(object):
         self.arc_drawable.setTransform(transform)
         self.arc_drawable.setParams({'line_width':3, 'color1':color, 'style':(5, 20), 'fade_factor':0.5, 'scale':hou.Vector3(scale, scale, scale)})
 
-        text = str(self.cur_angle) + u'\u00b0'
-        font_string = '<font size="{1}"<b> {0} </b></font>'.format(text.encode('utf-8'), 30)
-        self.angle_text_params['text'] = font_string
-
         self.angle_text_drawable.show(True)
         self.arc_drawable.show(True)
 
@@ -543,58 +2479,48 @@ class State(object):
         index = ray.index(max(ray))
         return index
 
-    def intersectWithPlane(self, origin, ray):
-        return Intersection(hou.hmath.intersectPlane(hou.Vector3(0, 0, 0), State.planes[self.curPlane], origin, ray), self.curPlane)
+    def toIntersection(self, positions, planes, points=None, weights=None):
+        plane = int(planes[0])
+        anchor = None
+        if self.anchor and points is not None and points[0, 0] >= 0:
+            anchor = (tuple(points[0].tolist()), tuple(weights[0].tolist()))
+        return Intersection(hou.Vector3(positions[0].tolist()), None if plane < 0 else plane, anchor)
 
-    def getIntersectionRegular(self, ui_event):
-        snapping_dict = hou.ViewerEvent.snappingRay(ui_event)
-        origin = snapping_dict["origin_point"]
-        ray = snapping_dict["direction"]
-        if self.geo_intersector.intersect(origin, ray):
-            if self.geo_intersector.snapped:
-                return Intersection(self.geo_intersector.snapped_position, None)
-            else:
-                return Intersection(self.geo_intersector.position, None)
-        else:
-            return self.intersectWithPlane(origin, ray)
-
-    # TODO: modify this to check ALL intersections, and then choose the closest one to this initial intersection
-    def getIntersectionAngleSnap(self, ui_event):
-        origin, ray = hou.ViewerEvent.ray(ui_event)
-        init_pos = self.getIntersectionRegular(ui_event).pos
-        measurement_vec = init_pos - self.measurements.current().getTailPos()
-        measurement_vec[self.curPlane] = 0 #project onto plane
-        plane_normal = State.planes[self.curPlane]
-        plane_vec = State.plane_to_next[self.curPlane]
-        angle = hou.Vector3.angleTo(measurement_vec, plane_vec)
-        assert angle >= 0
-        below_15 = (int(angle) / 15) * 15
-        above_15 = below_15 + 15
-        closest_angle = below_15 if angle - below_15 < 7.5 else above_15
-
-        if hou.Vector3.cross(plane_vec, measurement_vec).dot(plane_normal) < 0:
-            closest_angle = 360 - closest_angle 
-        self.cur_angle = closest_angle
-
-        rot = hou.hmath.buildRotateAboutAxis(plane_normal, closest_angle)
-        vec = plane_vec * rot
-        vec *= measurement_vec.length()
-        vec += self.measurements.current().getTailPos()
-        vec[self.curPlane] = origin[self.curPlane]
-        direction = plane_normal if hou.Vector3.dot(plane_normal, origin) < 0 else plane_normal * -1
-        if self.geo_intersector.intersect(vec, direction):
-            return Intersection(self.geo_intersector.position, None)
-        else:
-            return self.intersectWithPlane(vec, direction)
+    def pointSnapping(self):
+        return self.point_snap or hou.SceneViewer.snappingMode(self.scene_viewer) == hou.snappingMode.Point
 
-    def getIntersection(self, ui_event):
-        if self.angle_snapping:
-            return self.getIntersectionAngleSnap(ui_event)
+    def getIntersectionRegular(self, sample):
+        """ Cast the snapping ray through the engine. With point snapping on, 
+            it snaps within snap_radius pixels to the closest point of the k-d 
+            tree of the current cook, once that is built.
+        """
+        snap_radius = None
+        if self.pointSnapping():
+            self.engine.tree = requestNodeIndex(self.current_node, KDTree, self.geometry_viewport.draw)
+            snap_radius = self.view.pixelRadius(State.snap_radius)
+        snap_corners = hou.SceneViewer.snappingMode(self.scene_viewer) == hou.snappingMode.Point
+        positions, planes, points, weights = self.engine.intersectAnchored(tuple(sample.snap_origin), tuple(sample.snap_direction), 
+                (self.curPlane,), snap_radius, snap_corners)
+        return self.toIntersection(positions, planes, points, weights)
+
+    def getIntersectionAngleSnap(self, sample):
+        """ Snap the measurement to the nearest multiple of angle_step, see 
+            MeasureEngine.snapAngles.
+        """
+        init_pos = self.getIntersectionRegular(sample).pos
+        tail = self.measurements.current().getTailPos()
+        positions, angles, planes = self.engine.snapAngles(tuple(tail), tuple(init_pos), (self.curPlane,), 
+                tuple(sample.origin), State.angle_step)
+        self.cur_angle = int(angles[0])
+        return self.toIntersection(positions, planes)
+
+    def getIntersection(self, sample):
+        if self.angle_snapping and self.measurements.active != None:
+            return self.getIntersectionAngleSnap(sample)
         else:
-            return self.getIntersectionRegular(ui_event)
+            return self.getIntersectionRegular(sample)
 
-    def setMeasurementPlane(self, ui_event):
-        snapping_dict = hou.ViewerEvent.snappingRay(ui_event)
+    def setMeasurementPlane(self, sample):
         snap_mode = self.scene_viewer.snappingMode()
         cur_viewport = hou.SceneViewer.curViewport(self.scene_viewer)
         vt = hou.GeometryViewport.type(cur_viewport)
@@ -606,8 +2532,7 @@ class State(object):
             if vt == hou.geometryViewportType.Left or vt == hou.geometryViewportType.Right:
                 plane = Plane.X
         else:
-            ray = snapping_dict["direction"]
-            plane = self.findBestPlane(ray)
+            plane = self.findBestPlane(sample.snap_direction)
         if (self.active):
             self.measurements.current().setPlane(plane)
         self.curPlane = plane
@@ -617,112 +2542,383 @@ class State(object):
         hou.GeometryDrawable.setTransform(self.point_drawable, translate)
 
     def angleSnapping(self, yes):
-        self.measurements.current().angleSnapping(yes)
+        if self.measurements.active != None:
+            self.measurements.current().angleSnapping(yes)
         self.angle_snapping = yes
 
     def worldToScreen(self, pos):
         return hou.GeometryViewport.mapToScreen(self.geometry_viewport, pos)
 
     def getModelToNDC(self):
-        model_to_camera = hou.GeometryViewport.cameraToModelTransform(self.geometry_viewport).inverted()
-        camera_to_ndc = hou.GeometryViewport.ndcToCameraTransform(self.geometry_viewport).inverted()
-        return model_to_camera * camera_to_ndc
+        return self.view.model_to_ndc
 
     def getModelToCamera(self):
-        model_to_camera = hou.GeometryViewport.cameraToModelTransform(self.geometry_viewport).inverted()
-        return model_to_camera
+        return self.view.model_to_camera
 
     def getCameraToNDC(self):
-        camera_to_ndc = hou.GeometryViewport.ndcToCameraTransform(self.geometry_viewport).inverted()
-        return camera_to_ndc
+        return self.view.camera_to_ndc
 
     def removeMeasurement(self):
         self.measurements.removeMeasurement()
 
+    def refreshIntersector(self):
+        """ Swap in the BVH intersector once its background build is done. 
+            Until then intersections fall back to the principal planes. Runs 
+            on every mouse event and redraw, and a recook of the display node 
+            redraws the viewport, so this is where recooks are picked up: 
+            moved points refit the BVH in place, new topology rebuilds it. 
+            Anchored measurements are then moved along with the points.
+        """
+        if self.current_node == None:
+            return
+        bvh = requestNodeBVH(self.current_node, self.geometry_viewport.draw)
+        if bvh == None:
+            if not self.indexing:
+                self.indexing = True
+                self.scene_viewer.setPromptMessage( State.getMessage() + State.indexing_msg )
+            return
+        if self.engine.bvh is not bvh:
+            self.engine = MeasureEngine(bvh)
+        cook = hou.Node.cookCount(self.current_node)
+        if cook != self.anchor_cook and bvh.count > 0:
+            self.anchor_cook = cook
+            self.measurements.reanchor(bvh.positions)
+        if self.indexing:
+            self.indexing = False
+            self.scene_viewer.setPromptMessage( State.getMessage() )
+
     def onGenerate(self, kwargs):
         """ Assign the geometry to drawabled
         """
-        self.scene_viewer.setPromptMessage( State.msg )
+        self.scene_viewer.setPromptMessage( State.getMessage() )
         self.current_node = hou.SceneViewer.pwd(self.scene_viewer).displayNode()
         self.geometry = hou.SopNode.geometry(self.current_node)
-        self.geo_intersector = su.GeometryIntersector(self.geometry, self.scene_viewer)
+        self.engine = MeasureEngine()
+        self.refreshIntersector()
+        self.restoreMeasurements()
         self.setActive(False)
 
+    def restoreMeasurements(self):
+        """ Bring back the measurements saved on the display node, from its 
+            user data or else its sidecar file.
+        """
+        try:
+            store = MeasurementStore.load(self.current_node)
+            if store == None:
+                store = MeasurementStore.loadFile(MeasurementStore.sidecarPath(self.current_node))
+        except ValueError:
+            store = None #unreadable data, start over rather than fail to enter the state
+        if store != None:
+            self.measurements.restore(store)
+            self.anchor_cook = None #move anchored ends to the current frame on the next refresh
+        self.saved = (self.measurements.store, self.measurements.store.version)
+
+    def saveMeasurements(self):
+        """ Write the measurements back if they changed since they were 
+            restored, so just using the tool leaves the hip file unmodified.
+        """
+        if self.current_node == None:
+            return
+        store = self.measurements.store
+        if self.saved != None and self.saved[0] is store and self.saved[1] == store.version:
+            return
+        try:
+            store.save(self.current_node)
+        except (hou.PermissionError, hou.OperationFailed):
+            path = MeasurementStore.sidecarPath(self.current_node)
+            if store.count > 0:
+                store.saveFile(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+        self.saved = (store, store.version)
+
     def onResume(self, kwargs):
-        self.scene_viewer.setPromptMessage( State.msg )
+        self.scene_viewer.setPromptMessage( State.getMessage() + State.indexing_msg if self.indexing else State.getMessage() )
         self.show(True)
 
     def onExit(self, kwargs):
         hou.SceneViewer.clearPromptMessage(self.scene_viewer)
+        self.stopFlushing()
+        self.saveMeasurements()
         self.show(False)
+        Profiler.disable() #the Profile toggle starts off in the next session
 
     def onInterrupt(self,kwargs):
         pass
 
-    def updateInactive(self, ui_event):
-        self.setMeasurementPlane(ui_event)
-        intersection = self.getIntersection(ui_event)
+    def updateInactive(self, sample):
+        self.setMeasurementPlane(sample)
+        intersection = self.getIntersection(sample)
         self.setPointTransform(intersection.pos)
 
-    def onMouseActive(self, ui_event):
-        intersection = self.getIntersection(ui_event)
+    def onMouseActive(self, sample):
+        intersection = self.getIntersection(sample)
         screen_pos = self.worldToScreen(intersection.pos)
-        self.measurements.current().update(intersection, screen_pos, self.getModelToCamera(), self.getCameraToNDC(), self.scene_viewer)
-        self.show(True)
+        self.measurements.current().update(intersection, screen_pos, self.view)
+        self.measurements.current().head_anchor = intersection.anchor
+        self.measurements.current().snapped_angle = self.cur_angle if self.angle_snapping else None
+        self.measurements.showActive()
+
+    def scheduleActive(self, sample):
+        """ Run onMouseActive for sample now if the scheduler allows it. 
+            Otherwise keep it pending and make sure it is flushed from the 
+            event loop even if no further events arrive.
+        """
+        due = self.scheduler.submit(sample)
+        if due != None:
+            self.onMouseActive(due)
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            hou.ui.addEventLoopCallback(self.flushPending)
+
+    def flushPending(self):
+        if self.scheduler.pending == None:
+            self.stopFlushing()
+            return
+        due = self.scheduler.due()
+        if due != None and self.mode == Mode.measuring:
+            self.stopFlushing()
+            self.onMouseActive(due)
+            self.geometry_viewport.draw()
+
+    def stopFlushing(self):
+        if self.flush_scheduled:
+            self.flush_scheduled = False
+            hou.ui.removeEventLoopCallback(self.flushPending)
 
-    def setAngleTextPos(self, ui_event):
-        dev = hou.UIEvent.device(ui_event)
-        self.angle_text_params['translate'] = hou.Vector3(dev.mouseX(), dev.mouseY(), 0)
+    def setAngleTextPos(self, sample):
+        self.angle_text_params['translate'] = hou.Vector3(sample.mouse_x, sample.mouse_y, 0)
 
-    def onMouseStart(self, ui_event):
+    def onMouseStart(self, sample):
         self.measurements.addMeasurement(self.scene_viewer)
-        self.setMeasurementPlane(ui_event)
-        self.setAngleTextPos(ui_event)
-        intersection = self.getIntersection(ui_event)
+        self.setMeasurementPlane(sample)
+        self.setAngleTextPos(sample)
+        intersection = self.getIntersection(sample)
         self.measurements.current().setTailPos(intersection.pos)
+        self.measurements.current().tail_anchor = intersection.anchor
         if intersection.plane != None:
-            self.measurements.current().setTailDisk(intersection.plane, self.scene_viewer, self.getModelToCamera(), self.getCameraToNDC())
+            self.measurements.current().setTailDisk(intersection.plane, self.view)
 
     def onMouseEvent(self, kwargs):
         ui_event = kwargs["ui_event"]
         reason = hou.UIEvent.reason(ui_event)
+        sample = PointerSample(ui_event)
+        self.view.update()
+        self.refreshIntersector()
+        if self.shape != Shape.distance:
+            self.onShapeEvent(reason, sample)
+            return
         if (reason == hou.uiEventReason.Start):
             self.setActive(True)
-            self.onMouseStart(ui_event)
+            self.onMouseStart(sample)
             self.mode = Mode.pre_measurement
         elif (reason == hou.uiEventReason.Active):
             if self.mode == Mode.pre_measurement:
                 self.mode = Mode.measuring
             if self.mode == Mode.measuring:
-                self.onMouseActive(ui_event)
+                self.scheduleActive(sample)
         elif (reason == hou.uiEventReason.Changed):
+            self.scheduler.cancel()
+            self.stopFlushing()
             if self.mode == Mode.pre_measurement:
                 self.measurements.removeMeasurement()
+            elif self.mode == Mode.measuring:
+                self.onMouseActive(sample) #the release position is always applied exactly
+                self.measurements.commit()
             self.curPlane = None
             self.setActive(False)
         else:
-            self.updateInactive(ui_event)
+            self.updateInactive(sample)
+
+    def getShapeDrawing(self):
+        if self.shape_drawing == None:
+            self.shape_drawing = ShapeDrawing(self.scene_viewer, State.text_size)
+        return self.shape_drawing
+
+    def onShapeEvent(self, reason, sample):
+        """ Polylines, areas and angles are picked a vertex per click. While 
+            the button is down the rubber band follows the cursor, and the 
+            vertex is added where it is released. Angles finish on their 
+            third vertex, the others with the Finish Shape hotkey.
+        """
+        if self.mode != Mode.picking:
+            if reason != hou.uiEventReason.Start:
+                self.updateInactive(sample)
+                return
+            self.startShape(sample)
+        pos = self.getIntersectionRegular(sample).pos
+        self.setPointTransform(pos)
+        if reason == hou.uiEventReason.Changed:
+            self.totals.add(pos)
+            self.getShapeDrawing().add(pos)
+            if self.shape == Shape.angle and self.totals.count() == 3:
+                self.finishShape()
+                return
+        self.updateShape(pos)
+
+    def startShape(self, sample):
+        """ Begin a new shape, replacing the last one. All its vertices fall 
+            back to the plane picked for the first.
+        """
+        self.setMeasurementPlane(sample)
+        self.totals = ShapeTotals()
+        self.getShapeDrawing().clear()
+        self.mode = Mode.picking
+
+    def shapeLabel(self, value):
+        text = Shape.labels[self.shape].format(round(value, 5))
+        return u'<font size={1} color="{2}"><b> {0} </b></font>'.format(text, Measurement.default_font_size, self.getShapeDrawing().hex_str)
+
+    def updateShape(self, cursor):
+        """ Move the rubber band to cursor and show the total with it. 
+        """
+        drawing = self.getShapeDrawing()
+        if self.totals.count() < 1:
+            drawing.show(False, False)
+            return
+        last = self.totals.vertices[-1]
+        drawing.moveBand(last, cursor, self.totals.vertices[0] if self.shape == Shape.area else cursor)
+        drawing.setText(self.shapeLabel(self.totals.total(self.shape, cursor)), cursor)
+        drawing.show(True, True)
+
+    def finishShape(self):
+        """ Stop picking and leave the shape on screen with its total. An area 
+            keeps its closing edge.
+        """
+        self.mode = Mode.doing_nothing
+        drawing = self.getShapeDrawing()
+        if self.totals.count() < 1:
+            drawing.clear()
+            return
+        first, last = self.totals.vertices[0], self.totals.vertices[-1]
+        closed = self.shape == Shape.area and self.totals.count() > 2
+        if closed:
+            drawing.moveBand(last, first, first)
+        value = self.totals.total(self.shape)
+        drawing.setText(self.shapeLabel(value), last)
+        drawing.show(True, closed)
+        if self.shape == Shape.area:
+            hou.ui.setStatusMessage("Area {}, perimeter {}".format(round(value, 5), round(self.totals.perimeter(), 5)))
+        else:
+            hou.ui.setStatusMessage(Shape.labels[self.shape].format(round(value, 5)))
+        self.geometry_viewport.draw()
+
+    def removeShapeVertex(self):
+        """ Undo for shapes, dropping the last vertex. 
+        """
+        self.totals.pop()
+        drawing = self.getShapeDrawing()
+        drawing.rebuild(self.totals.vertices)
+        if self.totals.count() < 1:
+            self.mode = Mode.doing_nothing
+            drawing.clear()
+        else:
+            self.mode = Mode.picking #also resumes a finished shape
+            self.updateShape(self.totals.vertices[-1])
+        self.geometry_viewport.draw()
+
+    def setShape(self, shape):
+        if self.shape_drawing != None:
+            self.shape_drawing.clear()
+        self.totals = ShapeTotals()
+        self.shape = shape
+        self.mode = Mode.doing_nothing
+        self.curPlane = None
+        self.geometry_viewport.draw()
 
     def onKeyEvent(self, kwargs):
         ui_event = kwargs["ui_event"]
         device = ui_event.device()
         if device.isKeyPressed():
+            if hou.hotkeys.isKeyMatch(device.keyString(), Key.finish_shape):
+                if self.mode != Mode.picking: return False
+                self.finishShape()
+                return True
+            if self.shape != Shape.distance and self.totals.count() > 0:
+                if hou.hotkeys.isKeyMatch(device.keyString(), Key.undo):
+                    self.removeShapeVertex()
+                    return True
+                if hou.hotkeys.isKeyMatch(device.keyString(), Key.copy_to_clip):
+                    hou.ui.copyTextToClipboard(str(self.totals.total(self.shape)))
+                    return True
             if hou.hotkeys.isKeyMatch(device.keyString(), Key.undo):
                 self.measurements.removeMeasurement()
                 return True
             if hou.hotkeys.isKeyMatch(device.keyString(), Key.copy_to_clip):
                 if self.measurements.count() < 1: return
-                m = self.measurements.current().getLength()
+                m = self.measurements.lastLength()
                 hou.ui.copyTextToClipboard(str(m))
                 return True
             if hou.hotkeys.isKeyMatch(device.keyString(), Key.pop_copy):
                 if self.measurements.count() < 1: return
-                m = self.measurements.current().getLength()
+                m = self.measurements.lastLength()
                 hou.ui.copyTextToClipboard(str(m))
                 self.measurements.removeMeasurement()
                 return True
+            if hou.hotkeys.isKeyMatch(device.keyString(), Key.export):
+                self.exportMeasurements()
+                return True
+            if hou.hotkeys.isKeyMatch(device.keyString(), Key.sample_range):
+                self.sampleFrameRange()
+                return True
+            if hou.hotkeys.isKeyMatch(device.keyString(), Key.profile_report):
+                if not Profiler.enabled: return False
+                hou.ui.copyTextToClipboard(Profiler.report())
+                hou.ui.setStatusMessage("Copied the profiling report to the clip board.")
+                return True
         return False 
 
+    def exportMeasurements(self):
+        """ Ask for a file and write every committed measurement to it. 
+        """
+        store = self.measurements.store
+        if store.count < 1:
+            hou.ui.setStatusMessage("No measurements to export.", hou.severityType.Warning)
+            return
+        path = hou.ui.selectFile(title="Export Measurements", pattern="*.csv *.json *.npy", 
+                chooser_mode=hou.fileChooserMode.Write, default_value="$HIP/measurements.csv")
+        if not path:
+            return
+        path = hou.expandString(path)
+        try:
+            exportMeasurements(store, path)
+        except (ValueError, IOError, OSError) as e:
+            hou.ui.setStatusMessage("Export failed: {}".format(e), hou.severityType.Error)
+            return
+        hou.ui.setStatusMessage("Exported {} measurements to {}".format(store.count, path))
+
+    def sampleFrameRange(self):
+        """ Measure the committed measurements at every frame of the playbar 
+            range in worker processes, see FrameRangeSampler. The lengths are 
+            keyed on a ruler_samples node next to the display node as they 
+            come in and written to a CSV file beside the sidecar file.
+        """
+        store = self.measurements.store
+        if store.count < 1:
+            hou.ui.setStatusMessage("No measurements to sample.", hou.severityType.Warning)
+            return
+        if self.sampler != None and self.sampler.running():
+            hou.ui.setStatusMessage("Still sampling the previous frame range.", hou.severityType.Warning)
+            return
+        if hou.hipFile.hasUnsavedChanges():
+            hou.ui.setStatusMessage("Save the hip file first, the frames are sampled from the saved file.", hou.severityType.Warning)
+            return
+        start, end = hou.playbar.frameRange()
+        path = os.path.splitext(MeasurementStore.sidecarPath(self.current_node))[0] + ".samples.csv"
+        parent = hou.Node.parent(self.current_node)
+        try:
+            self.sample_node = hou.Node.node(parent, "ruler_samples") or hou.Node.createNode(parent, "null", "ruler_samples")
+        except (hou.PermissionError, hou.OperationFailed):
+            self.sample_node = None #locked network, only write the file
+        ends = SampleEnds.fromStore(store)
+        self.sampler = FrameRangeSampler(self.current_node, ends, range(int(start), int(end) + 1), path)
+        self.sampler.start(self.keySamples)
+        hou.ui.setStatusMessage("Sampling {} measurements over frames {} to {} into {}".format(store.count, int(start), int(end), path))
+
+    def keySamples(self, frames, lengths):
+        if self.sample_node != None:
+            keySampleChannels(self.sample_node, self.sampler.ends.names, frames, lengths)
+
     def onKeyTransitEvent(self, kwargs):
         ui_event = kwargs['ui_event']
         dev = ui_event.device()
@@ -734,29 +2930,199 @@ class State(object):
     def onParmChangeEvent(self, kwargs):
         parm_name = kwargs["parm_name"]
         parm_value = kwargs["parm_value"]
-        if parm_name == "show_text":
+        if parm_name == "point_snap":
+            self.point_snap = bool(parm_value)
+        elif parm_name == "anchor":
+            self.anchor = bool(parm_value)
+        elif parm_name == "show_text":
             if parm_value == True:
                 self.measurements.showText(True)
             else:
                 self.measurements.showText(False)
             self.geometry_viewport.draw()
+        elif parm_name == "shape":
+            self.setShape(int(parm_value))
         elif parm_name == "text_size_menu":
             State.text_size = float(parm_value)
             self.measurements.setScale(float(parm_value))
+            if self.shape_drawing != None:
+                self.shape_drawing.setScale(float(parm_value))
+            self.geometry_viewport.draw()
+        elif parm_name == "lod_length":
+            State.lod_length = float(parm_value)
+            self.measurements.setLodLength(float(parm_value))
+            self.geometry_viewport.draw()
+        elif parm_name == "profile":
+            if parm_value:
+                Profiler.reset()
+                Profiler.enable()
+            else:
+                Profiler.disable()
+            self.hud_drawable.show(bool(parm_value))
             self.geometry_viewport.draw()
             
     def onDraw( self, kwargs ):
         """ This callback is used for rendering the drawables
         """
         handle = kwargs["draw_handle"]
+        self.refreshIntersector()
         if not self.active:
             hou.GeometryDrawable.draw(self.point_drawable, handle, self.point_params)
-        self.measurements.draw(handle)
+        self.view.update()
+        self.measurements.draw(handle, self.view)
+        if self.shape_drawing != None:
+            self.shape_drawing.draw(handle, self.view)
         self.drawAngle(self.angle_snapping, handle)
+        if Profiler.enabled:
+            self.drawHud(handle)
+
+    def drawHud(self, handle):
+        """ Profiler summary in the top left corner, refreshed at most every 
+            hud_interval seconds.
+        """
+        now = time.time()
+        if now - self.hud_time > State.hud_interval:
+            self.hud_time = now
+            lines = Profiler.summary(State.hud_lines)
+            self.hud_params['text'] = '<font size=12 color="#f8f8f2">{}</font>'.format("\n".join(lines) if lines else "Profiling...")
+        self.hud_params['translate'][1] = self.view.size[1] - 20
+        hou.TextDrawable.draw(self.hud_drawable, handle, self.hud_params)
 
     def onDrawInterrupt(self, kwargs):
         handle = kwargs["draw_handle"]
-        self.measurements.drawInterrupt(handle, self.geometry_viewport)
+        self.view.update()
+        self.measurements.drawInterrupt(handle, self.geometry_viewport, self.view)
+        if self.shape_drawing != None:
+            self.shape_drawing.draw(handle, self.view)
+
+clock = getattr(time, 'perf_counter', time.time)
+
+class ProfileStat(object):
+    """ Call count, total and max time of one profiled callable, plus a 
+        histogram over fixed bucket edges.
+    """
+    edges = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1) #seconds, the last bucket is open ended
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(ProfileStat.edges) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(ProfileStat.edges, seconds)] += 1
+
+    def percentile(self, fraction):
+        """ Upper edge of the bucket holding the given fraction of calls, 
+            capped at the max.
+        """
+        needed = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= needed and n > 0:
+                return min(ProfileStat.edges[i], self.max) if i < len(ProfileStat.edges) else self.max
+        return self.max
+
+class Profiler(object):
+    """ Opt-in timing of the hot callbacks. enable() swaps each target for a 
+        timing wrapper and disable() puts the originals back, so when it is 
+        off nothing is wrapped and there is no overhead at all. Times are 
+        inclusive, e.g. onMouseEvent includes its getIntersection.
+    """
+    enabled = False
+    stats = {}
+    originals = []
+
+    @staticmethod
+    def targets():
+        module = sys.modules[__name__]
+        return ((State, 'onMouseEvent'), (State, 'onDraw'), (State, 'onDrawInterrupt'), (State, 'getIntersection'), 
+                (Measurement, 'update'), (MeasurementContainer, 'draw'), (MeasureEngine, 'intersectAnchored'), (MeasureEngine, 'snapAngles'), (State, 'onShapeEvent'), 
+                (DiskMaker, 'makeDisk'), (module, 'createSphereGeometry'), (module, 'createLineGeometry'), 
+                (module, 'createFrustumGeometry'), (module, 'createPointGeometry'), (module, 'createCircleGeometry'), 
+                (module, 'createArcGeometry'))
+
+    @staticmethod
+    def wrap(name, function):
+        stat = Profiler.stats.setdefault(name, ProfileStat())
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stat.add(clock() - start)
+        timed.__name__ = function.__name__
+        timed.__doc__ = function.__doc__
+        timed.__wrapped__ = function
+        return timed
+
+    @staticmethod
+    def enable():
+        if Profiler.enabled: return
+        Profiler.enabled = True
+        for owner, attr in Profiler.targets():
+            function = owner.__dict__[attr]
+            name = attr if owner is sys.modules[__name__] else owner.__name__ + "." + attr
+            Profiler.originals.append((owner, attr, function))
+            setattr(owner, attr, Profiler.wrap(name, function))
+
+    @staticmethod
+    def disable():
+        if not Profiler.enabled: return
+        Profiler.enabled = False
+        for owner, attr, function in Profiler.originals:
+            setattr(owner, attr, function)
+        Profiler.originals = []
+
+    @staticmethod
+    def reset():
+        for stat in Profiler.stats.values():
+            stat.__init__()
+
+    @staticmethod
+    def summary(limit=None):
+        """ One line per profiled callable that was called, slowest total 
+            first: calls, mean, p50, p95 and max in milliseconds.
+        """
+        called = [(stat.total, name, stat) for name, stat in Profiler.stats.items() if stat.count > 0]
+        called.sort(reverse=True)
+        lines = []
+        for total, name, stat in called[:limit]:
+            lines.append("{:<32} {:>7} calls  mean {:8.3f}  p50 {:8.3f}  p95 {:8.3f}  max {:8.3f} ms".format(
+                name, stat.count, 1000 * total / stat.count, 1000 * stat.percentile(0.5), 1000 * stat.percentile(0.95), 1000 * stat.max))
+        return lines
+
+    @staticmethod
+    def report():
+        """ summary() followed by each callable's histogram, as text. 
+        """
+        lines = Profiler.summary()
+        if not lines:
+            return "No profiled calls."
+        labels = ["<={:g}ms".format(1000 * e) for e in ProfileStat.edges] + [">{:g}ms".format(1000 * ProfileStat.edges[-1])]
+        lines.append("")
+        lines.append("{:<32} ".format("histogram") + " ".join("{:>9}".format(l) for l in labels))
+        for name in sorted(Profiler.stats):
+            stat = Profiler.stats[name]
+            if stat.count > 0:
+                lines.append("{:<32} ".format(name) + " ".join("{:>9}".format(n) for n in stat.buckets))
+        return "\n".join(lines)
+
+    @staticmethod
+    def dump(path):
+        with open(path, 'w') as f:
+            f.write(Profiler.report() + "\n")
+
+shape_item_info = [
+        (str(Shape.distance), 'Distance'),
+        (str(Shape.polyline), 'Polyline'),
+        (str(Shape.area), 'Area'),
+        (str(Shape.angle), 'Angle')]
 
 text_size_item_info = [
         ('0.25', '0.25'),
@@ -778,6 +3144,15 @@ def createViewerStateTemplate():
     template.bindFactory(State)
     template.bindIcon("MISC_python")
 
+    template.bindParameter(hou.parmTemplateType.Menu, name="shape", label="Measure", menu_items=shape_item_info, default_value=str(Shape.distance))
     template.bindParameter(hou.parmTemplateType.Menu, name="text_size_menu", label="Text Size", menu_items=text_size_item_info, default_value='1')
+    template.bindParameter(hou.parmTemplateType.Toggle, name="point_snap", label="Snap to Points", default_value=False)
+    template.bindParameter(hou.parmTemplateType.Toggle, name="anchor", label="Anchor to Geometry", default_value=False)
+    template.bindParameter(hou.parmTemplateType.Float, name="lod_length", label="Label Min Length", default_value=State.lod_length, min_limit=0.0, max_limit=200.0)
+    template.bindParameter(hou.parmTemplateType.Toggle, name="profile", label="Profile", default_value=False)
 
     return template
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["sample"]:
+        sampleMain(sys.argv[2:])